@@ -3,38 +3,74 @@
 
 
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash
+import click
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, jsonify, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 from flask_bcrypt import Bcrypt
-from models import init_db, get_db_connection
-import psycopg2
-import psycopg2.extras
+from models import init_db, init_app, connect, get_db_connection, get_pool, get_replica_url, replica_stats
+from repository import PostgresRepository, get_repository
+from cache import TTLCache, page_cache
+import ledger
+import importer
+import export
+import metrics
+import versions
+import settlement
+import live
+import jobs
+import assets
+import compression
+from passwords import PasswordHasher, PasswordPoolBusy, PASSWORD_WORKERS, PASSWORD_MAX_PENDING
 
 # Inicializar app
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'fallback-secret-key-for-dev')
 
+# Coste de bcrypt configurable; los hashes con otro coste se rehacen al iniciar sesión
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
 bcrypt = Bcrypt(app)
+passwords = PasswordHasher(bcrypt, app.config['BCRYPT_LOG_ROUNDS'], workers=PASSWORD_WORKERS, max_pending=PASSWORD_MAX_PENDING)
+job_worker = jobs.Worker(get_pool)
+# Una sola conexión LISTEN por proceso: avisos de compras (SSE) y de la cola de trabajos
+broadcaster = live.Broadcaster(connect, handlers={jobs.CHANNEL: job_worker.wake} if jobs.JOBS_IN_PROCESS else None)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Una conexión del pool por petición, devuelta al terminar
+init_app(app)
+# Tiempos por endpoint, consultas y plantillas (ver /metrics)
+metrics.init_app(app)
+# HTML comprimido al vuelo y static/ con huella en la URL y precomprimido
+compression.init_app(app)
+assets.init_app(app)
+
+# Tamaño de página para los listados paginados
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+
 # Modelo de usuario
 class User(UserMixin):
     def __init__(self, id, username):
         self.id = id
         self.username = username
 
+# Caché de usuarios por proceso: evita consultar usuarios en cada petición autenticada.
+# Cada worker tiene la suya; el TTL limita cuánto tarda en verse un borrado hecho en otro worker.
+user_cache = TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 60)),
+)
+
 @login_manager.user_loader
 def load_user(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cur.execute('SELECT id, username FROM usuarios WHERE id = %s', (user_id,))
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
+    user = user_cache.get(str(user_id))
+    if user is not None:
+        return user
+    user = get_repository(readonly=True).usuario(user_id)
     if user:
-        return User(user['id'], user['username'])
+        user = User(user.id, user.username)
+        user_cache.set(str(user_id), user)
+        return user
     return None
 
 # Función para verificar si es admin
@@ -43,55 +79,108 @@ def is_admin():
 
 # Crear usuario admin si no existe
 def create_admin_user():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM usuarios WHERE username = 'admin'")
-    if not cur.fetchone():
+    repo = PostgresRepository(connect())
+    if not repo.credenciales('admin'):
         hashed = bcrypt.generate_password_hash("salvatore777").decode('utf-8')
-        cur.execute("INSERT INTO usuarios (username, password_hash) VALUES (%s, %s)", ('admin', hashed))
-        conn.commit()
+        repo.crear_usuario('admin', hashed)
+        repo.commit()
         print("✅ Usuario admin creado: admin / salvatore777")
-    cur.close()
-    conn.close()
+    repo.conn.close()
+
+# Migraciones y usuario admin: se ejecutan con `flask --app app migrate` antes de
+# arrancar los workers, no al importar la app
+@app.cli.command('migrate', with_appcontext=False)
+def migrate_command():
+    applied = init_db()
+    for version, nombre in applied:
+        print(f'✅ Migración {version} aplicada: {nombre}')
+    if not applied:
+        print('El esquema ya está al día.')
+    create_admin_user()
+
+@app.cli.command('ledger-check', with_appcontext=False)
+@click.option('--rebuild', is_flag=True, help='Reconstruir saldos desde las compras.')
+def ledger_check_command(rebuild):
+    conn = connect()
+    try:
+        mismatches = ledger.verify(conn)
+        for evento_id, usuario_id, real, guardado, n_real, n_guardado in mismatches:
+            print(f'❌ evento {evento_id} usuario {usuario_id}: compras={real} ({n_real}) saldos={guardado} ({n_guardado})')
+        if not mismatches:
+            print('✅ Saldos consistentes con las compras.')
+        if rebuild:
+            rows = ledger.rebuild(conn)
+            print(f'✅ Saldos reconstruidos: {rows} filas.')
+    finally:
+        conn.close()
+
+# Paso de build: precomprime static/ (.gz y .br) para servirlo sin comprimir en cada petición.
+# Tiene que correr en la máquina que sirve la web (el release corre en otra y sus
+# ficheros no llegan): el Procfile lo ejecuta antes de gunicorn, y en Render va en el
+# Build Command: pip install -r requirements.txt && flask --app app assets
+@app.cli.command('assets', with_appcontext=False)
+def assets_command():
+    for filename, encoding, original, comprimido in assets.precompress(app.static_folder):
+        print(f'✅ {filename} ({encoding}): {original} -> {comprimido} bytes')
+
+@app.cli.command('jobs-worker', with_appcontext=False)
+@click.option('--once', is_flag=True, help='Ejecutar los trabajos pendientes y salir.')
+def jobs_worker_command(once):
+    if not once:
+        jobs.run_forever(connect)
+        return
+    conn = connect()
+    try:
+        print(f'✅ Trabajos ejecutados: {jobs.run_pending(conn)}.')
+    finally:
+        conn.close()
 
-# Inicializar base de datos y crear admin
-init_db()
-create_admin_user()
+# Un hilo de la cola de trabajos por proceso web, salvo con JOBS_IN_PROCESS=0
+# (p. ej. si hay procesos `flask --app app jobs-worker` dedicados)
+@app.before_request
+def start_job_worker():
+    if jobs.JOBS_IN_PROCESS:
+        job_worker.ensure_started()
+        broadcaster.ensure_started()
 
+# Borrados en segundo plano: la fila ya está oculta; el trabajo borra sus compras por lotes
+def encolar_borrado(repo, tipo, objetivo):
+    job_id = jobs.enqueue(repo.cursor(), tipo, objetivo)
+    repo.commit()
+    return job_id
 
 
 # Ruta para ver y gestionar compras propias en un evento
 @app.route('/mis-compras/<int:evento_id>', methods=['GET'])
+@metrics.query_budget(2)
 @login_required
 def mis_compras(evento_id):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cur.execute('SELECT nombre FROM eventos WHERE id = %s', (evento_id,))
-    evento = cur.fetchone()
+    repo = get_repository(readonly=True)
+    evento = repo.evento(evento_id)
     if not evento:
         flash('Evento no encontrado')
         return redirect(url_for('dashboard'))
-    cur.execute('''SELECT * FROM compras WHERE evento_id = %s AND comprador_id = %s ORDER BY id DESC''', (evento_id, current_user.id))
-    compras_usuario = cur.fetchall()
-    cur.close()
-    conn.close()
-    return render_template('mis_compras.html', evento_id=evento_id, evento_nombre=evento['nombre'], compras_usuario=compras_usuario)
+    compras_usuario = repo.compras_usuario(evento_id, current_user.id)
+    return render_template('mis_compras.html', evento_id=evento_id, evento_nombre=evento.nombre, compras_usuario=compras_usuario)
 
 # Ruta para eliminar una compra propia
 @app.route('/eliminar-compra/<int:compra_id>/<int:evento_id>', methods=['POST'])
+@metrics.query_budget(5)
 @login_required
 def eliminar_compra(compra_id, evento_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('DELETE FROM compras WHERE id = %s AND comprador_id = %s', (compra_id, current_user.id))
-    conn.commit()
-    cur.close()
-    conn.close()
+    repo = get_repository()
+    borrada = repo.borrar_compra(compra_id, current_user.id)
+    if borrada:
+        versions.bump(repo.cursor(), 'compras', evento_id=borrada.evento_id)
+        live.notify(repo.cursor(), 'eliminada', borrada.evento_id, current_user.username,
+                    {'id': borrada.id, 'descripcion': borrada.descripcion, 'monto': float(borrada.monto)})
+    repo.commit()
     flash('Compra eliminada correctamente.')
     return redirect(url_for('mis_compras', evento_id=evento_id))
 
 # Ruta para que el admin cree usuarios
 @app.route('/admin/create-user', methods=['GET', 'POST'])
+@metrics.query_budget(3)
 @login_required
 def admin_create_user():
     if not is_admin():
@@ -105,201 +194,302 @@ def admin_create_user():
         if not username or not password:
             error = 'Usuario y contraseña son obligatorios.'
         else:
-            conn = get_db_connection()
-            cur = conn.cursor()
+            repo = get_repository()
             try:
-                hashed = bcrypt.generate_password_hash(password).decode('utf-8')
-                cur.execute('INSERT INTO usuarios (username, password_hash) VALUES (%s, %s)', (username, hashed))
-                conn.commit()
+                repo.crear_usuario(username, passwords.hash(password))
+                versions.bump(repo.cursor(), 'catalogo')
+                repo.commit()
                 success = f'Usuario "{username}" creado exitosamente.'
-            except psycopg2.IntegrityError:
-                conn.rollback()
+            except repo.IntegrityError:
+                repo.rollback()
                 error = 'El nombre de usuario ya existe.'
-            finally:
-                cur.close()
-                conn.close()
-    # Cargar lista de usuarios para administración
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cur.execute("SELECT id, username FROM usuarios ORDER BY username")
-    usuarios = cur.fetchall()
-    cur.close()
-    conn.close()
-    return render_template('admin_create_user.html', error=error, success=success, usuarios=usuarios)
+    # Cargar una página de la lista de usuarios para administración
+    q = request.args.get('q', '').strip()
+    despues = request.args.get('despues')
+    usuarios, siguiente = get_repository().pagina_usuarios(q, despues, limite=PAGE_SIZE)
+    return render_template('admin_create_user.html', error=error, success=success, usuarios=usuarios,
+                           q=q, despues=despues, siguiente=siguiente)
 
 @app.route('/admin/delete-user/<int:user_id>', methods=['POST'])
+@metrics.query_budget(4)
 @login_required
 def admin_delete_user(user_id):
     if not is_admin():
         flash('Acceso denegado.')
         return redirect(url_for('dashboard'))
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    repo = get_repository()
     # No permitir borrar al usuario admin
-    cur.execute('SELECT username FROM usuarios WHERE id = %s', (user_id,))
-    row = cur.fetchone()
-    if not row:
+    usuario = repo.usuario(user_id)
+    if not usuario:
         flash('Usuario no encontrado.')
-    elif row['username'] == 'admin':
+    elif usuario.username == 'admin':
         flash('No se puede eliminar al usuario admin.')
-    else:
-        cur2 = conn.cursor()
-        cur2.execute('DELETE FROM usuarios WHERE id = %s', (user_id,))
-        conn.commit()
-        cur2.close()
-        flash('Usuario eliminado correctamente.')
-    cur.close()
-    conn.close()
+    elif repo.ocultar_usuario(user_id):
+        # Antes del borrado: los eventos afectados se localizan por sus saldos
+        versions.bump(repo.cursor(), 'catalogo', 'compras', comprador_id=user_id)
+        job_id = encolar_borrado(repo, 'eliminar_usuario', user_id)
+        user_cache.delete(str(user_id))
+        flash(f'Usuario eliminado. Sus compras se borran en segundo plano (trabajo #{job_id}).')
     return redirect(url_for('admin_create_user'))
 
+# Estado de la cola de trabajos en segundo plano
+@app.route('/admin/trabajos')
+@metrics.query_budget(1)
+@login_required
+def admin_trabajos():
+    if not is_admin():
+        flash('Acceso denegado.')
+        return redirect(url_for('dashboard'))
+    trabajos = jobs.recent(get_repository().cursor())
+    return render_template('admin_trabajos.html', trabajos=trabajos)
+
+# Pool de bcrypt saturado: rechazar rápido para no bloquear el worker
+@app.errorhandler(PasswordPoolBusy)
+def password_pool_busy(e):
+    return 'Servidor ocupado, inténtalo de nuevo en unos segundos.', 503, {'Retry-After': '1'}
+
+
+@app.errorhandler(live.StreamsBusy)
+def streams_busy(e):
+    # El navegador no reconecta un EventSource tras un 503: la página lo reintenta
+    return 'Demasiadas conexiones en directo.', 503, {'Retry-After': str(live.SSE_BUSY_RETRY_SECONDS)}
+
+# Métricas en formato Prometheus: solo admin, o con METRICS_TOKEN para el scraper
+@app.route('/metrics')
+@metrics.query_budget(0)
+def metrics_view():
+    token = os.environ.get('METRICS_TOKEN')
+    if not (is_admin() or (token and request.headers.get('Authorization') == f'Bearer {token}')):
+        abort(403)
+    gauges = []
+    for key, value in get_pool().stats().items():
+        gauges.append((f'db_pool_{key}', f'Pool de conexiones: {key}.', value))
+    if get_replica_url():
+        for key, value in get_pool(replica=True).stats().items():
+            gauges.append((f'db_replica_pool_{key}', f'Pool de conexiones a la réplica: {key}.', value))
+        for key, value in replica_stats().items():
+            gauges.append((f'db_replica_{key}', f'Réplica de lectura: {key}.', value))
+    for key, value in user_cache.stats().items():
+        gauges.append((f'user_cache_{key}', f'Caché de usuarios: {key}.', value))
+    for key, value in page_cache.stats().items():
+        gauges.append((f'page_cache_{key}', f'Caché de páginas: {key}.', value))
+    gauges.append(('sse_subscribers', 'Clientes SSE conectados a este worker.', broadcaster.subscriber_count()))
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 # Rutas
 @app.route('/login', methods=['GET', 'POST'])
+@metrics.query_budget(2)
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute('SELECT id, username, password_hash FROM usuarios WHERE username = %s', (username,))
-        user = cur.fetchone()
-        cur.close()
-        conn.close()
-        if user and bcrypt.check_password_hash(user['password_hash'], password):
-            login_user(User(user['id'], user['username']))
+        repo = get_repository()
+        user = repo.credenciales(username)
+        if user and passwords.verify(user.password_hash, password):
+            if passwords.needs_rehash(user.password_hash):
+                repo.actualizar_hash(user.id, passwords.hash(password))
+                repo.commit()
+            login_user(User(user.id, user.username))
             return redirect(url_for('dashboard'))
         else:
             flash('Usuario o contraseña incorrectos')
     return render_template('login.html')
 
 @app.route('/logout')
+@metrics.query_budget(0)
 @login_required
 def logout():
     logout_user()
     return redirect(url_for('login'))
 
 @app.route('/')
+@metrics.query_budget(2)
 @login_required
 def dashboard():
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    # Mostrar solo eventos NO asociados al usuario logueado
-    cur.execute('SELECT id, nombre FROM eventos WHERE usuario_id != %s ORDER BY nombre', (current_user.id,))
-    eventos = cur.fetchall()
-    cur.close()
-    conn.close()
-    return render_template('dashboard.html', eventos=eventos)
+    repo = get_repository(readonly=True)
+    etag, last_modified = versions.validators(versions.lookup(repo.cursor()), 'catalogo')
+    respuesta = versions.not_modified(etag, last_modified)
+    if respuesta:
+        return respuesta
+    # La página renderizada se cachea con el ETag como clave (usuario, URL y versiones).
+    # Solo la primera página sin búsqueda: con ?q= o ?despues= cualquiera puede crear
+    # entradas nuevas sin fin y echar de la caché las páginas que sí se repiten.
+    cacheable = not request.args
+    html = page_cache.get('catalogo.', etag) if cacheable else None
+    if html is None:
+        # Mostrar solo eventos NO asociados al usuario logueado
+        q = request.args.get('q', '').strip()
+        despues = request.args.get('despues')
+        eventos, siguiente = repo.pagina_eventos(q, despues, excluir_usuario=current_user.id, limite=PAGE_SIZE)
+        html = render_template('dashboard.html', eventos=eventos, q=q, despues=despues, siguiente=siguiente)
+        if cacheable:
+            page_cache.set('catalogo.', etag, html)
+    return versions.with_validators(html, etag, last_modified)
 
 @app.route('/register', methods=['GET', 'POST'])
+@metrics.query_budget(0)
 def register():
     return render_template('register_disabled.html')
 
 @app.route('/crear-evento', methods=['GET', 'POST'])
+@metrics.query_budget(3)
 @login_required
 def crear_evento():
     if not is_admin():
         flash('Acceso denegado. Solo el administrador puede crear eventos.')
         return redirect(url_for('dashboard'))
     
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cur.execute('SELECT id, username FROM usuarios ORDER BY username')
-    usuarios = cur.fetchall()
-    cur.execute('SELECT id, nombre FROM eventos ORDER BY nombre')
-    eventos = cur.fetchall()
-    cur.close()
+    repo = get_repository()
     if request.method == 'POST':
         if 'eliminar_evento' in request.form:
-            evento_id = request.form['eliminar_evento']
-            cur = conn.cursor()
-            cur.execute('DELETE FROM eventos WHERE id = %s', (evento_id,))
-            conn.commit()
-            cur.close()
-            flash('Evento eliminado correctamente.')
+            flash(eliminar_evento_en_segundo_plano(repo, request.form['eliminar_evento']))
             return redirect(url_for('crear_evento'))
         nombre = request.form.get('nombre', '').strip()
         usuario_id = request.form.get('usuario_id')
         if not nombre or not usuario_id:
             flash('El nombre del evento y el usuario son obligatorios.')
         else:
-            cur = conn.cursor()
             try:
-                cur.execute('INSERT INTO eventos (nombre, usuario_id) VALUES (%s, %s)', (nombre, usuario_id))
-                conn.commit()
+                repo.crear_evento(nombre, usuario_id)
+                versions.bump(repo.cursor(), 'catalogo')
+                repo.commit()
                 flash(f'Evento "{nombre}" creado exitosamente.')
                 return redirect(url_for('dashboard'))
-            except psycopg2.IntegrityError:
-                conn.rollback()
+            except repo.IntegrityError:
+                repo.rollback()
                 flash('Ya existe un evento con ese nombre.')
-            finally:
-                cur.close()
-                conn.close()
-            return render_template('crear_evento.html', usuarios=usuarios, eventos=eventos)
-    conn.close()
-    return render_template('crear_evento.html', usuarios=usuarios, eventos=eventos)
+    # Una página de eventos (?q=, ?despues=) y otra del selector de usuarios (?uq=, ?udespues=)
+    q = request.args.get('q', '').strip()
+    despues = request.args.get('despues')
+    uq = request.args.get('uq', '').strip()
+    udespues = request.args.get('udespues')
+    usuarios, usiguiente = repo.pagina_usuarios(uq, udespues, limite=PAGE_SIZE)
+    eventos, siguiente = repo.pagina_eventos(q, despues, limite=PAGE_SIZE)
+    return render_template('crear_evento.html', usuarios=usuarios, eventos=eventos,
+                           q=q, despues=despues, siguiente=siguiente,
+                           uq=uq, udespues=udespues, usiguiente=usiguiente)
+
+def eliminar_evento_en_segundo_plano(repo, evento_id):
+    # Devuelve el mensaje para el admin
+    if not repo.ocultar_evento(evento_id):
+        return 'Evento no encontrado.'
+    versions.bump(repo.cursor(), 'catalogo', 'compras')
+    job_id = encolar_borrado(repo, 'eliminar_evento', evento_id)
+    return f'Evento eliminado. Sus compras se borran en segundo plano (trabajo #{job_id}).'
 
 # Ruta para eliminar evento (POST)
 @app.route('/eliminar-evento/<int:evento_id>', methods=['POST'])
+@metrics.query_budget(3)
 @login_required
 def eliminar_evento(evento_id):
     if not is_admin():
         flash('Acceso denegado.')
         return redirect(url_for('dashboard'))
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('DELETE FROM eventos WHERE id = %s', (evento_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
-    flash('Evento eliminado correctamente.')
+    flash(eliminar_evento_en_segundo_plano(get_repository(), evento_id))
     return redirect(url_for('crear_evento'))
 
+# Ruta para que el admin importe compras en bloque (CSV / JSON) en un evento
+@app.route('/admin/importar-compras/<int:evento_id>', methods=['GET', 'POST'])
+@metrics.query_budget(6)
+@login_required
+def importar_compras(evento_id):
+    if not is_admin():
+        flash('Acceso denegado. Solo el administrador puede importar compras.')
+        return redirect(url_for('dashboard'))
+    repo = get_repository()
+    evento = repo.evento(evento_id)
+    if not evento:
+        flash('Evento no encontrado')
+        return redirect(url_for('crear_evento'))
+    resultado = None
+    if request.method == 'POST':
+        archivo = request.files.get('archivo')
+        if not archivo or not archivo.filename:
+            flash('Selecciona un fichero CSV o JSON.')
+        else:
+            rows = importer.read_rows(archivo.stream, archivo.filename)
+            resultado = importer.import_purchases(repo.conn, evento_id, rows)
+    return render_template('importar_compras.html', evento_id=evento_id, evento_nombre=evento.nombre, resultado=resultado)
+
 @app.route('/evento/<int:evento_id>')
+@metrics.query_budget(4)
 @login_required
 def ver_evento(evento_id):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    cur.execute('SELECT nombre FROM eventos WHERE id = %s', (evento_id,))
-    evento = cur.fetchone()
+    repo = get_repository(readonly=True)
+
+    etag, last_modified = versions.validators(versions.lookup(repo.cursor(), evento_id), 'evento', 'catalogo')
+    respuesta = versions.not_modified(etag, last_modified)
+    if respuesta:
+        return respuesta
+
+    evento = repo.evento(evento_id)
     if not evento:
         flash('Evento no encontrado')
         return redirect(url_for('dashboard'))
     
-    cur.execute('''
-        SELECT c.*, u.username AS comprador
-        FROM compras c
-        JOIN usuarios u ON c.comprador_id = u.id
-        WHERE c.evento_id = %s
-        ORDER BY c.id DESC
-    ''', (evento_id,))
-    compras = cur.fetchall()
-
-    # Compras solo del usuario actual para este evento
-    compras_usuario = [c for c in compras if c['comprador_id'] == current_user.id]
+    # Totales por comprador calculados en SQL (ordenados por su compra más reciente)
+    totales = repo.totales_evento(evento_id)
 
-    total_general = sum(c['monto'] for c in compras) if compras else 0
-    total_usuario = sum(c['monto'] for c in compras if c['comprador_id'] == current_user.id)
+    total_general = sum(t.total for t in totales) if totales else 0
+    total_usuario = sum(t.total for t in totales if t.comprador_id == current_user.id)
+    gastos_por_usuario = {t.username: float(t.total) for t in totales}
 
-    gastos_por_usuario = {}
-    for c in compras:
-        comprador = c['comprador']
-        gastos_por_usuario[comprador] = gastos_por_usuario.get(comprador, 0) + float(c['monto'])
+    # Compras del usuario actual, paginadas por id descendente (keyset)
+    antes = request.args.get('antes', type=int)
+    compras_usuario, siguiente = repo.compras_usuario(evento_id, current_user.id, antes, limite=PAGE_SIZE)
 
-    cur.close()
-    conn.close()
-
-    return render_template(
+    return versions.with_validators(render_template(
         'add_purchase.html',
         evento_id=evento_id,
-        evento_nombre=evento['nombre'],
-        compras=compras,
+        evento_nombre=evento.nombre,
         total_general=total_general,
         total_usuario=total_usuario,
         gastos_por_usuario=gastos_por_usuario,
-        compras_usuario=compras_usuario
+        compras_usuario=compras_usuario,
+        antes=antes,
+        siguiente=siguiente
+    ), etag, last_modified)
+
+# Actualizaciones en directo del evento (Server-Sent Events). Sin stream_with_context:
+# la conexión de la petición vuelve al pool antes de que empiece el streaming.
+@app.route('/evento/<int:evento_id>/stream')
+@metrics.query_budget(0)
+@login_required
+def stream_evento(evento_id):
+    suscripcion = broadcaster.subscribe(evento_id, limit=live.SSE_MAX_STREAMS)
+    return Response(
+        live.sse_stream(broadcaster, evento_id, suscripcion),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Exportar todas las compras de un evento (CSV / JSON en streaming)
+@app.route('/evento/<int:evento_id>/exportar/<fmt>')
+@metrics.query_budget(2)
+@login_required
+def exportar_compras(evento_id, fmt):
+    if fmt not in export.FORMATS:
+        abort(404)
+    repo = get_repository(readonly=True)
+    if not repo.evento(evento_id):
+        flash('Evento no encontrado')
+        return redirect(url_for('dashboard'))
+    columns = ['id', 'comprador', 'destinatario', 'descripcion', 'monto']
+    rows = export.iter_query(repo.conn, '''
+        SELECT c.id, u.username, c.destinatario, c.descripcion, c.monto
+        FROM compras c
+        JOIN usuarios u ON c.comprador_id = u.id
+        WHERE c.evento_id = %s AND NOT u.eliminado
+        ORDER BY c.id
+    ''', (evento_id,))
+    return Response(
+        stream_with_context(export.stream(fmt, columns, rows)),
+        mimetype=export.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename=compras_evento_{evento_id}.{fmt}'}
     )
 
 @app.route('/compra', methods=['POST'])
+@metrics.query_budget(5)
 @login_required
 def agregar_compra():
     evento_id = request.form['evento_id']
@@ -312,44 +502,32 @@ def agregar_compra():
         flash('Monto inválido')
         return redirect(url_for('ver_evento', evento_id=evento_id))
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO compras (evento_id, comprador_id, destinatario, descripcion, monto)
-        VALUES (%s, %s, %s, %s, %s)
-    ''', (evento_id, current_user.id, destinatario, descripcion, monto))
-    conn.commit()
-    cur.close()
-    conn.close()
+    repo = get_repository()
+    # Un evento oculto espera a que jobs.py lo borre: ya no admite compras
+    if not repo.evento(evento_id):
+        flash('Evento no encontrado')
+        return redirect(url_for('dashboard'))
+    try:
+        compra = repo.agregar_compra(evento_id, current_user.id, destinatario, descripcion, monto)
+    except repo.IntegrityError:
+        # Borrado entre la comprobación y el INSERT
+        repo.rollback()
+        flash('Evento no encontrado')
+        return redirect(url_for('dashboard'))
+    versions.bump(repo.cursor(), 'compras', evento_id=evento_id)
+    live.notify(repo.cursor(), 'nueva', evento_id, current_user.username,
+                {'id': compra.id, 'descripcion': compra.descripcion, 'monto': float(compra.monto)})
+    repo.commit()
     return redirect(url_for('mis_compras', evento_id=evento_id))
 
 
 # --- Ruta /cuenta-total movida junto al resto de rutas ---
 
-@app.route('/cuenta-total')
-@login_required
-def cuenta_total():
-    if not is_admin():
-        flash('Acceso denegado. Solo el administrador puede ver la cuenta total.')
-        return redirect(url_for('dashboard'))
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    # Obtener aportaciones de compras (solo de usuarios que NO son 'admin') para TODOS los eventos
-    cur.execute('''
-        SELECT c.comprador_id, u.username, SUM(c.monto) AS total_aportado
-        FROM compras c
-        JOIN usuarios u ON c.comprador_id = u.id
-        WHERE u.username != 'admin'
-        GROUP BY c.comprador_id, u.username
-    ''')
-    aportaciones = {row['username']: float(row['total_aportado']) for row in cur.fetchall()}
-    # Obtener TODOS los usuarios registrados EXCEPTO 'admin'
-    cur.execute("SELECT username FROM usuarios WHERE username != 'admin' ORDER BY username")
-    usuarios_normales = [row['username'] for row in cur.fetchall()]
-    # Si no hay usuarios normales, mostrar advertencia
-    if not usuarios_normales:
-        flash('No hay usuarios participantes (sin contar al admin).')
-        return redirect(url_for('dashboard'))
+def resumen_saldos(filas):
+    # filas: (username, total_aportado) de los usuarios participantes.
+    # Calcula total, cuota justa, saldo por usuario y las transferencias para cuadrar.
+    aportaciones = {row.username: float(row.total_aportado) for row in filas}
+    usuarios_normales = [row.username for row in filas]
     # Calcular total general (solo de usuarios normales)
     total_general = sum(aportaciones.get(u, 0) for u in usuarios_normales)
     num_usuarios = len(usuarios_normales)
@@ -364,91 +542,142 @@ def cuenta_total():
             'cuota_justa': cuota_justa,
             'saldo': saldo
         }
-    cur.close()
-    conn.close()
-    return render_template(
-        'cuenta_total.html',
-        total_general=total_general,
-        num_usuarios=num_usuarios,
-        cuota_justa=cuota_justa,
-        saldos=saldos
+    return {
+        'total_general': total_general,
+        'num_usuarios': num_usuarios,
+        'cuota_justa': cuota_justa,
+        'saldos': saldos,
+        'transferencias': settlement.settle({u: d['saldo'] for u, d in saldos.items()}),
+    }
+
+def filas_cuentas_evento(repo, evento_id):
+    # Devuelve (evento, filas) o (None, None) si el evento no existe.
+    # El usuario asociado al evento no participa en sus cuentas.
+    evento = repo.evento(evento_id)
+    if not evento:
+        return None, None
+    return evento, repo.aportaciones_evento(evento_id, evento.usuario_evento)
+
+@app.route('/cuenta-total')
+@metrics.query_budget(2)
+@login_required
+def cuenta_total():
+    if not is_admin():
+        flash('Acceso denegado. Solo el administrador puede ver la cuenta total.')
+        return redirect(url_for('dashboard'))
+    repo = get_repository(readonly=True)
+    etag, last_modified = versions.validators(versions.lookup(repo.cursor()), 'compras', 'catalogo')
+    respuesta = versions.not_modified(etag, last_modified)
+    if respuesta:
+        return respuesta
+    html = page_cache.get('compras.', etag)
+    if html is not None:
+        return versions.with_validators(html, etag, last_modified)
+    # Aportaciones de TODOS los usuarios excepto 'admin' para TODOS los eventos
+    filas = repo.aportaciones_total()
+    # Si no hay usuarios normales, mostrar advertencia
+    if not filas:
+        flash('No hay usuarios participantes (sin contar al admin).')
+        return redirect(url_for('dashboard'))
+    html = render_template('cuenta_total.html', **resumen_saldos(filas))
+    page_cache.set('compras.', etag, html)
+    return versions.with_validators(html, etag, last_modified)
+
+
+# Saldos y transferencias de la cuenta total en JSON
+@app.route('/cuenta-total/transferencias')
+@metrics.query_budget(1)
+@login_required
+def transferencias_cuenta_total():
+    if not is_admin():
+        abort(403)
+    return jsonify(resumen_saldos(get_repository(readonly=True).aportaciones_total()))
+
+
+# Exportar los saldos de la cuenta total (CSV / JSON en streaming)
+@app.route('/cuenta-total/exportar/<fmt>')
+@metrics.query_budget(1)
+@login_required
+def exportar_cuenta_total(fmt):
+    if not is_admin():
+        flash('Acceso denegado. Solo el administrador puede ver la cuenta total.')
+        return redirect(url_for('dashboard'))
+    if fmt not in export.FORMATS:
+        abort(404)
+    conn = get_db_connection(readonly=True)
+    columns = ['usuario', 'aportado', 'cuota_justa', 'saldo']
+    # Misma regla que /cuenta-total, con la cuota justa calculada en SQL
+    rows = export.iter_query(conn, '''
+        SELECT username, aportado, ROUND(cuota_justa, 2), ROUND(aportado - cuota_justa, 2)
+        FROM (
+            SELECT username, aportado, SUM(aportado) OVER () / COUNT(*) OVER () AS cuota_justa
+            FROM (
+                SELECT u.username, COALESCE(SUM(s.total), 0)::DECIMAL(12, 2) AS aportado
+                FROM usuarios u
+                LEFT JOIN (saldos s
+                           JOIN eventos e ON e.id = s.evento_id AND NOT e.eliminado
+                           JOIN usuarios o ON o.id = e.usuario_id AND NOT o.eliminado) ON s.usuario_id = u.id
+                WHERE u.username != 'admin' AND NOT u.eliminado
+                GROUP BY u.username
+            ) a
+        ) t
+        ORDER BY username
+    ''')
+    return Response(
+        stream_with_context(export.stream(fmt, columns, rows)),
+        mimetype=export.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename=cuenta_total.{fmt}'}
     )
 
 
 @app.route('/cuentas/<int:evento_id>')
+@metrics.query_budget(3)
 @login_required
 def cuentas(evento_id):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    # Verificar que el evento existe
-    cur.execute('SELECT nombre FROM eventos WHERE id = %s', (evento_id,))
-    evento = cur.fetchone()
+    repo = get_repository(readonly=True)
+
+    etag, last_modified = versions.validators(versions.lookup(repo.cursor(), evento_id), 'evento', 'catalogo')
+    respuesta = versions.not_modified(etag, last_modified)
+    if respuesta:
+        return respuesta
+    html = page_cache.get(f'evento-{evento_id}.', etag)
+    if html is not None:
+        return versions.with_validators(html, etag, last_modified)
+
+    evento, filas = filas_cuentas_evento(repo, evento_id)
     if not evento:
         flash('Evento no encontrado')
         return redirect(url_for('dashboard'))
-    
-    # Obtener el usuario asociado al evento
-    cur.execute('SELECT usuario_id FROM eventos WHERE id = %s', (evento_id,))
-    evento_row = cur.fetchone()
-    usuario_evento_id = evento_row['usuario_id'] if evento_row else None
-
-    # Obtener nombre de usuario asociado al evento
-    usuario_evento_username = None
-    if usuario_evento_id:
-        cur.execute('SELECT username FROM usuarios WHERE id = %s', (usuario_evento_id,))
-        user_row = cur.fetchone()
-        if user_row:
-            usuario_evento_username = user_row['username']
-
-    # Obtener aportaciones de compras (solo de usuarios que NO son 'admin' NI el usuario asociado al evento)
-    cur.execute('''
-        SELECT c.comprador_id, u.username, SUM(c.monto) AS total_aportado
-        FROM compras c
-        JOIN usuarios u ON c.comprador_id = u.id
-        WHERE c.evento_id = %s AND u.username != 'admin' AND u.username != %s
-        GROUP BY c.comprador_id, u.username
-    ''', (evento_id, usuario_evento_username))
-    aportaciones = {row['username']: float(row['total_aportado']) for row in cur.fetchall()}
-
-    # Obtener TODOS los usuarios registrados EXCEPTO 'admin' y el usuario asociado al evento
-    cur.execute("SELECT username FROM usuarios WHERE username != 'admin' AND username != %s ORDER BY username", (usuario_evento_username,))
-    usuarios_normales = [row['username'] for row in cur.fetchall()]
 
     # Si no hay usuarios normales, mostrar advertencia
-    if not usuarios_normales:
+    if not filas:
         flash('No hay usuarios participantes (sin contar al admin ni el usuario asociado al evento).')
         return redirect(url_for('ver_evento', evento_id=evento_id))
 
-    # Calcular total general (solo de usuarios normales)
-    total_general = sum(aportaciones.get(u, 0) for u in usuarios_normales)
-    num_usuarios = len(usuarios_normales)
-    cuota_justa = total_general / num_usuarios if num_usuarios > 0 else 0
-
-    # Calcular saldo por usuario (solo usuarios normales)
-    saldos = {}
-    for usuario in usuarios_normales:
-        aportado = aportaciones.get(usuario, 0)
-        saldo = aportado - cuota_justa
-        saldos[usuario] = {
-            'aportado': aportado,
-            'cuota_justa': cuota_justa,
-            'saldo': saldo
-        }
-    
-    cur.close()
-    conn.close()
-    
-    return render_template(
+    html = render_template(
         'cuentas.html',
         evento_id=evento_id,
-        evento_nombre=evento['nombre'],
-        total_general=total_general,
-        num_usuarios=num_usuarios,
-        cuota_justa=cuota_justa,
-        saldos=saldos
+        evento_nombre=evento.nombre,
+        **resumen_saldos(filas)
     )
+    page_cache.set(f'evento-{evento_id}.', etag, html)
+    return versions.with_validators(html, etag, last_modified)
+
+# Saldos y transferencias de un evento en JSON
+@app.route('/cuentas/<int:evento_id>/transferencias')
+@metrics.query_budget(2)
+@login_required
+def transferencias_evento(evento_id):
+    evento, filas = filas_cuentas_evento(get_repository(readonly=True), evento_id)
+    if not evento:
+        abort(404)
+    resumen = resumen_saldos(filas)
+    resumen['evento'] = evento.nombre
+    return jsonify(resumen)
 
 if __name__ == '__main__':
+    # En desarrollo local se prepara la base de datos al arrancar
+    init_db()
+    create_admin_user()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
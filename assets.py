@@ -0,0 +1,136 @@
+# Ficheros de static/ con huella en la URL: url_for('static', filename='style.css')
+# genera /static/style.<hash>.css y esa URL se cachea un año como immutable (el
+# contenido nunca cambia: un fichero nuevo tiene otra URL). Las URLs sin huella o con
+# una huella antigua se siguen sirviendo, pero sin caché larga.
+# `flask --app app assets` (en el paso de build) deja al lado de cada fichero de texto
+# sus versiones .gz y .br; se sirven cuando el cliente los
+# acepta y no son más antiguos que el original.
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+import brotli
+from flask import abort, current_app, send_from_directory
+from werkzeug.security import safe_join
+
+import compression
+
+STATIC_MAX_AGE = 365 * 24 * 3600
+PRECOMPRESS_EXTENSIONS = ('.css', '.js', '.mjs', '.json', '.svg', '.txt', '.html', '.xml', '.map')
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# Mejor compresión posible: se hace una vez por despliegue
+PRECOMPRESS_GZIP_LEVEL = 9
+PRECOMPRESS_BROTLI_QUALITY = 11
+
+_FINGERPRINTED = re.compile(r'^(?P<base>.+)\.(?P<huella>[0-9a-f]{12})(?P<ext>\.[^./]+)$')
+
+_hashes = {}  # ruta relativa a static/ -> huella del contenido
+
+
+def _static_files(static_dir):
+    for root, _, files in os.walk(static_dir):
+        for name in files:
+            if not name.endswith(tuple(SUFFIXES.values())):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, static_dir).replace(os.sep, '/'), path
+
+
+def fingerprints(static_dir):
+    hashes = {}
+    for filename, path in _static_files(static_dir):
+        with open(path, 'rb') as f:
+            hashes[filename] = hashlib.sha256(f.read()).hexdigest()[:12]
+    return hashes
+
+
+def fingerprinted(filename):
+    huella = _hashes.get(filename)
+    if huella is None:
+        return filename
+    base, ext = os.path.splitext(filename)
+    return f'{base}.{huella}{ext}'
+
+
+def resolve(filename):
+    # (fichero real, True si la URL lleva la huella de su contenido actual)
+    m = _FINGERPRINTED.match(filename)
+    if m:
+        original = m.group('base') + m.group('ext')
+        if original in _hashes:
+            return original, _hashes[original] == m.group('huella')
+    return filename, False
+
+
+def precompress(static_dir):
+    # Escribe los .gz/.br que ahorran bytes (y borra los que no). Devuelve una lista de
+    # (fichero, codificación, bytes originales, bytes comprimidos) de los escritos.
+    written = []
+    for filename, path in _static_files(static_dir):
+        if not filename.endswith(PRECOMPRESS_EXTENSIONS):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        variants = {
+            'gzip': lambda: gzip.compress(data, PRECOMPRESS_GZIP_LEVEL, mtime=0),
+            'br': lambda: brotli.compress(data, quality=PRECOMPRESS_BROTLI_QUALITY),
+        }
+        for encoding, compress in variants.items():
+            target = path + SUFFIXES[encoding]
+            body = compress()
+            if len(body) >= len(data):
+                if os.path.exists(target):
+                    os.remove(target)
+                continue
+            # Escritura atómica: un worker nunca sirve un fichero a medias
+            with open(target + '.tmp', 'wb') as f:
+                f.write(body)
+            os.replace(target + '.tmp', target)
+            written.append((filename, encoding, len(data), len(body)))
+    return written
+
+
+def _precompressed(path):
+    # Codificaciones con fichero precomprimido al día
+    mtime = os.path.getmtime(path)
+    return [e for e in compression.available_encodings()
+            if os.path.exists(path + SUFFIXES[e]) and os.path.getmtime(path + SUFFIXES[e]) >= mtime]
+
+
+def static_view(filename):
+    static_dir = current_app.static_folder
+    filename, immutable = resolve(filename)
+    path = safe_join(static_dir, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    max_age = STATIC_MAX_AGE if immutable else None
+    encodings = _precompressed(path)
+    encoding = compression.choose_encoding(encodings)
+    if encoding:
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(static_dir, filename + SUFFIXES[encoding], mimetype=mimetype, max_age=max_age)
+        response.headers['Content-Encoding'] = encoding
+        if response.status_code == 200:
+            compression.record('static', encoding, os.path.getsize(path), response.content_length)
+    else:
+        response = send_from_directory(static_dir, filename, max_age=max_age)
+    if encodings:
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+
+def _url_defaults(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = fingerprinted(values['filename'])
+
+
+def init_app(app):
+    # Huellas calculadas al arrancar: static/ solo cambia con un despliegue
+    _hashes.clear()
+    _hashes.update(fingerprints(app.static_folder))
+    app.url_defaults(_url_defaults)
+    app.view_functions['static'] = static_view
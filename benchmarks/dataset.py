@@ -0,0 +1,89 @@
+# Datos reproducibles para los benchmarks de carga:
+#   python -m benchmarks.dataset --usuarios 10000 --eventos 1000 --compras 1000000 --reset
+# Usa DATABASE_URL (o --database-url). Aplica las migraciones con models.init_db y genera
+# las filas en el servidor con generate_series y random() con semilla fija: con los mismos
+# tamaños y semilla se obtienen exactamente los mismos datos.
+# Usuarios bench000001... con contraseña BENCH_PASSWORD, eventos 'Evento 000001'...
+import argparse
+import os
+import sys
+import time
+
+BENCH_PASSWORD = 'bench'
+DEFAULT_SIZES = {'usuarios': 1000, 'eventos': 100, 'compras': 100000}
+
+
+def seed(usuarios, eventos, compras, semilla=0.42, reset=False):
+    import models
+    import ledger
+    from app import create_admin_user, passwords
+
+    conn = models.connect()
+    cur = conn.cursor()
+    if reset:
+        cur.execute('DROP SCHEMA public CASCADE; CREATE SCHEMA public;')
+        conn.commit()
+    models.init_db()
+    create_admin_user()
+    cur.execute("SELECT count(*) FROM usuarios WHERE username LIKE 'bench%'")
+    if cur.fetchone()[0]:
+        conn.close()
+        raise SystemExit('La base de datos ya tiene datos de benchmark; usa --reset para regenerarlos.')
+
+    start = time.perf_counter()
+    # Un solo hash con el coste de la app (BCRYPT_LOG_ROUNDS): el login no tiene que rehacerlo
+    hashed = passwords.hash(BENCH_PASSWORD)
+    cur.execute('SELECT setseed(%s)', (semilla,))
+    cur.execute('''
+        INSERT INTO usuarios (username, password_hash)
+        SELECT 'bench' || lpad(i::text, 6, '0'), %s FROM generate_series(1, %s) i
+        RETURNING id
+    ''', (hashed, usuarios))
+    primer_usuario = min(row[0] for row in cur.fetchall())
+    cur.execute('''
+        INSERT INTO eventos (nombre, usuario_id)
+        SELECT 'Evento ' || lpad(i::text, 6, '0'), %s + floor(random() * %s)::int
+        FROM generate_series(1, %s) i
+        RETURNING id
+    ''', (primer_usuario, usuarios, eventos))
+    primer_evento = min(row[0] for row in cur.fetchall())
+    cur.execute('''
+        INSERT INTO compras (evento_id, comprador_id, destinatario, descripcion, monto)
+        SELECT %s + floor(random() * %s)::int, %s + floor(random() * %s)::int,
+               'bench', 'Regalo ' || i, round((1 + random() * 199)::numeric, 2)
+        FROM generate_series(1, %s) i
+    ''', (primer_evento, eventos, primer_usuario, usuarios, compras))
+    conn.commit()
+    ledger.rebuild(conn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute('ANALYZE')
+    conn.close()
+    return time.perf_counter() - start
+
+
+def sizes(conn):
+    # Tamaños reales de la base de datos, para guardarlos junto a los resultados
+    cur = conn.cursor()
+    cur.execute('SELECT (SELECT count(*) FROM usuarios), (SELECT count(*) FROM eventos), (SELECT count(*) FROM compras)')
+    usuarios, eventos, compras = cur.fetchone()
+    conn.rollback()
+    return {'usuarios': usuarios, 'eventos': eventos, 'compras': compras}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.dataset', description='Genera datos de benchmark.')
+    for name, default in DEFAULT_SIZES.items():
+        parser.add_argument(f'--{name}', type=int, default=default)
+    parser.add_argument('--semilla', type=float, default=0.42, help='semilla de random() (entre -1 y 1)')
+    parser.add_argument('--reset', action='store_true', help='borra el esquema antes de generar (¡destruye datos!)')
+    parser.add_argument('--database-url', help='por defecto DATABASE_URL')
+    args = parser.parse_args(argv)
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    seconds = seed(args.usuarios, args.eventos, args.compras, args.semilla, args.reset)
+    print(f'✅ {args.usuarios} usuarios, {args.eventos} eventos y {args.compras} compras en {seconds:.1f} s')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,320 @@
+# Benchmark de carga por ruta sobre una base generada con benchmarks.dataset:
+#   python -m benchmarks.load --driver client --sesiones 8 --peticiones 200
+#   python -m benchmarks.load --driver gunicorn --workers 2 --threads 8 --save main
+#   python -m benchmarks.load --driver gunicorn --workers 2 --threads 8 --compare main
+# Cada sesión concurrente inicia sesión con su propio usuario bench (y el admin para las
+# rutas de administración) antes de medir. Las rutas se miden una tras otra; para cada una
+# se informa de p50/p95/p99 de latencia y de peticiones por segundo.
+# El driver "client" usa el test client de Flask en este proceso (aísla el coste de la app);
+# "gunicorn" arranca el servidor real en un subproceso y le habla por HTTP.
+# Los resultados se guardan como JSON en benchmarks/baselines/<nombre>.json.
+# Las páginas cacheadas cuentan como aciertos, igual que en producción; para medir el
+# render completo, arrancar con PAGE_CACHE_MAX_BYTES=0.
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmarks.dataset import BENCH_PASSWORD
+
+ADMIN_PASSWORD = 'salvatore777'
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Ruta -> (solo admin, generador de URL a partir de (rng, ids de eventos))
+ROUTES = {
+    'dashboard': (False, lambda rng, eventos: '/'),
+    'ver_evento': (False, lambda rng, eventos: f'/evento/{rng.choice(eventos)}'),
+    'mis_compras': (False, lambda rng, eventos: f'/mis-compras/{rng.choice(eventos)}'),
+    'cuentas': (False, lambda rng, eventos: f'/cuentas/{rng.choice(eventos)}'),
+    'transferencias_evento': (False, lambda rng, eventos: f'/cuentas/{rng.choice(eventos)}/transferencias'),
+    'cuenta_total': (True, lambda rng, eventos: '/cuenta-total'),
+    'admin_create_user': (True, lambda rng, eventos: '/admin/create-user'),
+}
+
+
+class ClientSession:
+    # Sesión sobre el test client de Flask (sin red ni servidor)
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self, username, password):
+        response = self.client.post('/login', data={'username': username, 'password': password})
+        return response.status_code == 302
+
+    def get(self, path):
+        response = self.client.get(path)
+        response.close()
+        return response.status_code
+
+
+class HttpSession:
+    # Sesión HTTP con cookies contra un servidor real; las redirecciones no se siguen
+    # para que cada petición medida sea exactamente una ida y vuelta
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self._NoRedirect())
+
+    def _open(self, path, data=None):
+        try:
+            with self.opener.open(self.base_url + path, data=data, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+    def login(self, username, password):
+        data = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+        return self._open('/login', data) == 302
+
+    def get(self, path):
+        return self._open(path)
+
+
+def percentile(sorted_values, p):
+    # Percentil por rango más cercano sobre una lista ya ordenada
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies, errors, seconds):
+    latencies = sorted(latencies)
+    ms = lambda p: round(percentile(latencies, p) * 1000, 3) if latencies else None
+    return {
+        'peticiones': len(latencies) + errors,
+        'errores': errors,
+        'p50_ms': ms(50),
+        'p95_ms': ms(95),
+        'p99_ms': ms(99),
+        'rps': round((len(latencies) + errors) / seconds, 1) if seconds else None,
+    }
+
+
+def run_route(sessions, route, eventos, peticiones, semilla=42):
+    # Todas las sesiones a la vez contra una ruta; cada una hace `peticiones` GET
+    admin_only, make_path = ROUTES[route]
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(sessions) + 1)
+
+    def worker(i, user_session, admin_session):
+        session = admin_session if admin_only else user_session
+        rng = random.Random(f'{semilla}-{route}-{i}')
+        paths = [make_path(rng, eventos) for _ in range(peticiones)]
+        local, local_errors = [], 0
+        barrier.wait()
+        for path in paths:
+            start = time.perf_counter()
+            status = session.get(path)
+            elapsed = time.perf_counter() - start
+            if status == 200:
+                local.append(elapsed)
+            else:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, args=(i, *pair)) for i, pair in enumerate(sessions)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+def bench_users(conn, n):
+    cur = conn.cursor()
+    cur.execute("SELECT username FROM usuarios WHERE username LIKE 'bench%%' ORDER BY username LIMIT %s", (n,))
+    usernames = [row[0] for row in cur.fetchall()]
+    cur.execute('SELECT id FROM eventos ORDER BY id')
+    eventos = [row[0] for row in cur.fetchall()]
+    conn.rollback()
+    if len(usernames) < n or not eventos:
+        raise SystemExit('Faltan datos de benchmark: genera la base con python -m benchmarks.dataset')
+    return usernames, eventos
+
+
+def open_sessions(make_session, usernames):
+    # Logins secuenciales (fuera de la medición) para no saturar el pool de bcrypt
+    sessions = []
+    for username in usernames:
+        user_session, admin_session = make_session(), make_session()
+        if not user_session.login(username, BENCH_PASSWORD) or not admin_session.login('admin', ADMIN_PASSWORD):
+            raise SystemExit(f'No se pudo iniciar sesión como {username} o admin')
+        sessions.append((user_session, admin_session))
+    return sessions
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workers, threads, timeout=30):
+    # El log de gunicorn va a un fichero temporal: una tubería sin leer acabaría bloqueándolo
+    port = _free_port()
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--worker-class', 'gthread', '--workers', str(workers),
+         '--threads', str(threads), '--bind', f'127.0.0.1:{port}', 'app:app'],
+        cwd=ROOT_DIR, env=dict(os.environ), stdout=subprocess.DEVNULL, stderr=log)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise SystemExit('gunicorn terminó al arrancar:\n' + log.read().decode(errors='replace'))
+        try:
+            if HttpSession(base_url).get('/login') == 200:
+                return process, base_url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('gunicorn no respondió a tiempo')
+
+
+def run(driver='client', routes=None, sesiones=8, peticiones=100, workers=2, threads=8, semilla=42):
+    import models
+    from benchmarks.dataset import sizes
+
+    conn = models.connect()
+    usernames, eventos = bench_users(conn, sesiones)
+    datos = sizes(conn)
+    conn.close()
+
+    process = None
+    if driver == 'gunicorn':
+        process, base_url = start_gunicorn(workers, threads)
+        make_session = lambda: HttpSession(base_url)
+    else:
+        from app import app
+        make_session = lambda: ClientSession(app)
+    try:
+        sessions = open_sessions(make_session, usernames)
+        resultados = {route: run_route(sessions, route, eventos, peticiones, semilla) for route in routes or ROUTES}
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+    return {
+        'driver': driver,
+        'sesiones': sesiones,
+        'peticiones_por_sesion': peticiones,
+        'workers': workers if driver == 'gunicorn' else None,
+        'threads': threads if driver == 'gunicorn' else None,
+        'datos': datos,
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'rutas': resultados,
+    }
+
+
+def baseline_path(nombre):
+    return os.path.join(BASELINES_DIR, f'{nombre}.json')
+
+
+def save_baseline(nombre, resultado):
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    with open(baseline_path(nombre), 'w') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+
+
+def load_baseline(nombre):
+    with open(baseline_path(nombre)) as f:
+        return json.load(f)
+
+
+def compare(base, actual, tolerancia=0.10):
+    # Lista de (ruta, métrica, antes, ahora, cambio relativo, regresión) por ruta común.
+    # Más latencia o menos rps que la tolerancia cuenta como regresión.
+    filas = []
+    for route, nuevo in actual['rutas'].items():
+        viejo = base['rutas'].get(route)
+        if not viejo:
+            continue
+        for metrica in ('p50_ms', 'p95_ms', 'p99_ms', 'rps'):
+            antes, ahora = viejo.get(metrica), nuevo.get(metrica)
+            if not antes or ahora is None:
+                continue
+            cambio = (ahora - antes) / antes
+            peor = -cambio if metrica == 'rps' else cambio
+            filas.append((route, metrica, antes, ahora, cambio, peor > tolerancia))
+    return filas
+
+
+def print_results(resultado):
+    datos = resultado['datos']
+    print(f"driver={resultado['driver']} sesiones={resultado['sesiones']} "
+          f"usuarios={datos['usuarios']} eventos={datos['eventos']} compras={datos['compras']}")
+    print(f'{"ruta":<22} {"peticiones":>10} {"errores":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"rps":>9}')
+    for route, r in resultado['rutas'].items():
+        print(f"{route:<22} {r['peticiones']:>10} {r['errores']:>8} {r['p50_ms'] or 0:>9.2f} "
+              f"{r['p95_ms'] or 0:>9.2f} {r['p99_ms'] or 0:>9.2f} {r['rps'] or 0:>9.1f}")
+
+
+def print_comparison(filas):
+    print(f'{"ruta":<22} {"métrica":<8} {"antes":>9} {"ahora":>9} {"cambio":>8}')
+    for route, metrica, antes, ahora, cambio, regresion in filas:
+        marca = '  ⚠️ regresión' if regresion else ''
+        print(f'{route:<22} {metrica:<8} {antes:>9.2f} {ahora:>9.2f} {cambio:>+8.1%}{marca}')
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description='Benchmark de carga por ruta.')
+    parser.add_argument('--driver', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--rutas', help='lista separada por comas; por defecto: ' + ','.join(ROUTES))
+    parser.add_argument('--sesiones', type=int, default=8, help='sesiones autenticadas concurrentes')
+    parser.add_argument('--peticiones', type=int, default=100, help='peticiones por sesión y ruta')
+    parser.add_argument('--workers', type=int, default=2, help='workers de gunicorn')
+    parser.add_argument('--threads', type=int, default=8, help='hilos por worker de gunicorn')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--database-url', help='por defecto DATABASE_URL')
+    parser.add_argument('--save', metavar='NOMBRE', help='guarda el resultado en benchmarks/baselines/NOMBRE.json')
+    parser.add_argument('--compare', metavar='NOMBRE', help='compara con benchmarks/baselines/NOMBRE.json')
+    parser.add_argument('--tolerancia', type=float, default=0.10, help='cambio relativo que cuenta como regresión')
+    args = parser.parse_args(argv)
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    routes = args.rutas.split(',') if args.rutas else None
+    for route in routes or ():
+        if route not in ROUTES:
+            parser.error(f'ruta desconocida: {route}')
+
+    resultado = run(args.driver, routes, args.sesiones, args.peticiones, args.workers, args.threads, args.semilla)
+    print_results(resultado)
+    if args.save:
+        save_baseline(args.save, resultado)
+        print(f'✅ Guardado en {baseline_path(args.save)}')
+    if args.compare:
+        filas = compare(load_baseline(args.compare), resultado, args.tolerancia)
+        print_comparison(filas)
+        if any(regresion for *_, regresion in filas):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
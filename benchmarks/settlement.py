@@ -0,0 +1,31 @@
+# Benchmark del motor de liquidación: python -m benchmarks.settlement [n ...]
+import random
+import sys
+import time
+
+from settlement import settle
+
+
+def run(n, repeat=5, seed=42):
+    rng = random.Random(seed)
+    cents = [rng.randint(-100000, 100000) for _ in range(n - 1)]
+    cents.append(-sum(cents))
+    saldos = {f'usuario{i}': c / 100 for i, c in enumerate(cents)}
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        transferencias = settle(saldos)
+        best = min(best, time.perf_counter() - start)
+    return best, len(transferencias)
+
+
+def main(argv):
+    sizes = [int(a) for a in argv] or [100, 1000, 10000, 100000]
+    print(f'{"participantes":>14} {"transferencias":>15} {"ms (mejor de 5)":>16}')
+    for n in sizes:
+        seconds, count = run(n)
+        print(f'{n:>14} {count:>15} {seconds * 1000:>16.2f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # Caché LRU en memoria del proceso con caducidad por entrada
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # clave -> (caduca, valor)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+
+class PageCache:
+    # Páginas renderizadas en un LRU limitado por tamaño, con un directorio opcional
+    # (p. ej. en /dev/shm) compartido entre los workers de gunicorn. Las claves incluyen
+    # la versión de los datos, así que una entrada antigua nunca se sirve; invalidate()
+    # solo libera espacio. Cada entrada pertenece a un ámbito ('catalogo.', 'compras.',
+    # 'evento-<id>.') que se invalida por prefijo. El directorio también tiene un límite
+    # (directory_max_bytes): al pasarlo se borran los ficheros escritos hace más tiempo.
+    def __init__(self, max_bytes=8 * 1024 * 1024, directory=None, directory_max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.directory_max_bytes = directory_max_bytes
+        # Bytes escritos por este proceso desde la última poda del directorio
+        self._written = 0
+        self._data = OrderedDict()  # (ámbito, clave) -> html
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, scope, key):
+        return os.path.join(self.directory, scope + hashlib.sha1(key.encode('utf-8')).hexdigest() + '.html')
+
+    def _store(self, scope, key, value):
+        old = self._data.pop((scope, key), None)
+        if old is not None:
+            self._bytes -= len(old)
+        if len(value) > self.max_bytes:
+            return
+        self._data[(scope, key)] = value
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def get(self, scope, key):
+        if key is None:
+            return None
+        with self._lock:
+            value = self._data.get((scope, key))
+            if value is not None:
+                self._data.move_to_end((scope, key))
+                self.hits += 1
+                return value
+        if self.directory:
+            try:
+                with open(self._path(scope, key), encoding='utf-8') as f:
+                    value = f.read()
+            except OSError:
+                value = None
+            if value is not None:
+                with self._lock:
+                    self._store(scope, key, value)
+                    self.shared_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, scope, key, value):
+        if key is None:
+            return
+        with self._lock:
+            self._store(scope, key, value)
+        if self.directory:
+            # Escritura atómica para que otro worker nunca lea un fichero a medias
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(value)
+                os.replace(tmp, self._path(scope, key))
+            except OSError:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                return
+            # Podar en cada escritura obligaría a listar el directorio en cada fallo de
+            # caché: se poda cada vez que este proceso ha escrito una décima parte del
+            # límite (con varios workers se puede pasar un poco, nunca sin cota)
+            with self._lock:
+                self._written += len(value)
+                prune = self._written * 10 >= self.directory_max_bytes
+                if prune:
+                    self._written = 0
+            if prune:
+                self._prune_directory()
+
+    def _prune_directory(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.tmp'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.directory_max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def invalidate(self, *prefixes):
+        with self._lock:
+            for scope, key in [k for k in self._data if k[0].startswith(prefixes)]:
+                self._bytes -= len(self._data.pop((scope, key)))
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.startswith(prefixes):
+                    try:
+                        os.unlink(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+
+    def clear(self):
+        self.invalidate('')
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.shared_hits + self.misses
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.shared_hits) / total if total else 0.0,
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+page_cache = PageCache(
+    max_bytes=int(os.environ.get('PAGE_CACHE_MAX_BYTES', 8 * 1024 * 1024)),
+    directory=os.environ.get('PAGE_CACHE_DIR') or None,
+    directory_max_bytes=int(os.environ.get('PAGE_CACHE_DIR_MAX_BYTES', 64 * 1024 * 1024)),
+)
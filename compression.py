@@ -0,0 +1,74 @@
+# Compresión de respuestas. Las páginas HTML a partir de COMPRESS_MIN_BYTES se
+# comprimen al vuelo (brotli si el cliente lo acepta, si no gzip); los
+# ficheros de static/ se sirven ya comprimidos desde el build (ver assets.py).
+# Por endpoint se cuentan los bytes sin comprimir y los ahorrados (ver /metrics).
+import gzip
+import os
+
+import brotli
+from flask import request
+
+import metrics
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_MIMETYPES = {'text/html'}
+# Niveles pensados para comprimir en cada petición: casi todo el ahorro por poca CPU
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+ORIGINAL_BYTES = metrics.Counter(
+    'http_compression_original_bytes_total', 'Bytes sin comprimir de las respuestas comprimidas.', ('endpoint', 'encoding'))
+SAVED_BYTES = metrics.Counter(
+    'http_compression_saved_bytes_total', 'Bytes ahorrados por la compresión.', ('endpoint', 'encoding'))
+
+
+def available_encodings():
+    # En orden de preferencia del servidor
+    return ('br', 'gzip')
+
+
+def choose_encoding(encodings):
+    # La primera de `encodings` (en orden de preferencia del servidor) que acepte el cliente
+    for encoding in encodings:
+        if request.accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # mtime=0: misma entrada, mismos bytes (ETags y ficheros del build reproducibles)
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+
+def record(endpoint, encoding, original, sent):
+    ORIGINAL_BYTES.inc(endpoint, encoding, amount=original)
+    SAVED_BYTES.inc(endpoint, encoding, amount=original - sent)
+
+
+def _after_request(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(available_encodings())
+    if encoding is None:
+        return response
+    body = compress(data, encoding)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # El ETag describe la página, no sus bytes: débil (como hace nginx) para que el
+    # If-None-Match del navegador siga dando 304 con cualquier codificación
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    record(request.endpoint or 'none', encoding, len(data), len(body))
+    return response
+
+
+def init_app(app):
+    app.after_request(_after_request)
@@ -0,0 +1,79 @@
+# Exportación en streaming (CSV / JSON) leyendo con un cursor con nombre (server-side),
+# de modo que la memoria del worker no depende del número de filas. La cabecera sale
+# antes de ejecutar la consulta y la primera fila en cuanto llega; a partir de ahí se
+# agrupan en trozos de CHUNK_SIZE.
+import csv
+import io
+import json
+import uuid
+from decimal import Decimal
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+}
+ITERSIZE = 2000
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_query(conn, sql, params=()):
+    cur = conn.cursor(name=f'export_{uuid.uuid4().hex}')
+    cur.itersize = ITERSIZE
+    try:
+        cur.execute(sql, params)
+        for row in cur:
+            yield row
+    finally:
+        cur.close()
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'{type(value).__name__} no es serializable')
+
+
+def _take(buf):
+    value = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return value
+
+
+def to_csv(columns, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    # La cabecera (y con ella la respuesta HTTP) sale antes de ejecutar la consulta
+    yield _take(buf)
+    primera = True
+    for row in rows:
+        writer.writerow(row)
+        if primera or buf.tell() >= CHUNK_SIZE:
+            yield _take(buf)
+            primera = False
+    yield buf.getvalue()
+
+
+def to_json(columns, rows):
+    yield '['
+    parts = []
+    size = 0
+    sep = ''
+    for row in rows:
+        item = sep + json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False)
+        parts.append(item)
+        size += len(item)
+        if not sep or size >= CHUNK_SIZE:
+            yield ''.join(parts)
+            parts = []
+            size = 0
+        sep = ','
+    parts.append(']')
+    yield ''.join(parts)
+
+
+def stream(fmt, columns, rows):
+    if fmt == 'csv':
+        return to_csv(columns, rows)
+    return to_json(columns, rows)
@@ -0,0 +1,115 @@
+# Importación masiva de compras (CSV, JSON o JSON Lines) para un evento.
+# Las filas se validan en una sola pasada y se cargan con COPY en una única
+# transacción; si alguna fila es inválida no se importa nada.
+import csv
+import io
+import json
+import tempfile
+import time
+from decimal import Decimal, InvalidOperation
+
+import ledger
+import live
+import versions
+
+MAX_MONTO = Decimal('99999999.99')  # límite de DECIMAL(10, 2)
+MAX_ERRORS = 100
+
+COPY_SQL = '''
+    COPY compras (evento_id, comprador_id, destinatario, descripcion, monto)
+    FROM STDIN WITH (FORMAT csv)
+'''
+
+
+def read_rows(stream, filename):
+    # Genera (número de fila, dict) a partir del fichero subido sin cargarlo entero,
+    # salvo los .json (array), que json necesita leer completos
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    name = (filename or '').lower()
+    if name.endswith('.jsonl'):
+        for n, line in enumerate(text, 1):
+            if line.strip():
+                yield n, json.loads(line)
+    elif name.endswith('.json'):
+        for n, row in enumerate(json.load(text), 1):
+            yield n, row
+    else:
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def validate(row, usuarios):
+    # Devuelve (comprador_id, destinatario, descripcion, monto) o lanza ValueError
+    if not isinstance(row, dict):
+        raise ValueError('la fila no es un objeto')
+    comprador = str(row.get('comprador') or '').strip()
+    if comprador not in usuarios:
+        raise ValueError(f'comprador desconocido: "{comprador}"')
+    descripcion = str(row.get('descripcion') or '').strip()
+    if not descripcion:
+        raise ValueError('descripción vacía')
+    try:
+        monto = Decimal(str(row.get('monto')).strip()).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f'monto inválido: "{row.get("monto")}"')
+    if not monto.is_finite() or abs(monto) > MAX_MONTO:
+        raise ValueError(f'monto fuera de rango: "{row.get("monto")}"')
+    destinatario = str(row.get('destinatario') or comprador).strip()
+    if len(destinatario) > 50:
+        raise ValueError('destinatario demasiado largo (máx. 50)')
+    return usuarios[comprador], destinatario, descripcion, monto
+
+
+def import_purchases(conn, evento_id, rows):
+    # rows: iterable de (número de fila, dict). Devuelve un resumen con
+    # filas importadas, errores por fila y filas por segundo.
+    start = time.monotonic()
+    cur = conn.cursor()
+    cur.execute('SELECT username, id FROM usuarios WHERE NOT eliminado')
+    usuarios = dict(cur.fetchall())
+
+    errors = []
+    totals = {}  # comprador_id -> [total, num_compras]
+    count = 0
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024, mode='w+', newline='') as buf:
+        writer = csv.writer(buf)
+        try:
+            for n, row in rows:
+                try:
+                    comprador_id, destinatario, descripcion, monto = validate(row, usuarios)
+                except ValueError as e:
+                    if len(errors) < MAX_ERRORS:
+                        errors.append((n, str(e)))
+                    continue
+                writer.writerow((evento_id, comprador_id, destinatario, descripcion, monto))
+                acc = totals.setdefault(comprador_id, [Decimal(0), 0])
+                acc[0] += monto
+                acc[1] += 1
+                count += 1
+        except (ValueError, csv.Error, UnicodeDecodeError) as e:
+            # JSON o CSV mal formado: no se puede seguir leyendo
+            errors.append((None, f'fichero ilegible: {e}'))
+
+        if not errors and count:
+            buf.seek(0)
+            try:
+                cur.copy_expert(COPY_SQL, buf)
+                ledger.add_purchases(cur, evento_id, totals)
+                versions.bump(cur, 'compras', evento_id=evento_id)
+                live.notify(cur, 'importacion', evento_id, None)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    cur.close()
+
+    elapsed = time.monotonic() - start
+    imported = count if not errors else 0
+    return {
+        'imported': imported,
+        'valid': count,
+        'errors': errors,
+        'seconds': elapsed,
+        'rows_per_second': imported / elapsed if elapsed > 0 else 0.0,
+    }
@@ -0,0 +1,244 @@
+# Cola de trabajos en segundo plano sobre la tabla trabajos (migración 6).
+# Borrar un evento o un usuario con muchas compras en la petición bloqueaba el worker y
+# mantenía los bloqueos del ON DELETE CASCADE durante todo el borrado. Ahora la ruta solo
+# lo oculta (eliminado = true) y encola un trabajo; los workers borran sus compras por
+# lotes de JOBS_BATCH_SIZE, cada lote en su propia transacción y con los saldos y las
+# versiones al día, y al final borran la fila (la cascada ya no tiene nada que recorrer).
+# - Los workers reclaman trabajos con FOR UPDATE SKIP LOCKED, así que puede haber
+#   varios a la vez: un hilo en cada proceso web (JOBS_IN_PROCESS, por defecto) y/o
+#   procesos dedicados con `flask --app app jobs-worker`.
+# - El hilo de un proceso web no abre conexiones propias: toma una del pool mientras
+#   ejecuta trabajos y recibe los avisos por la conexión LISTEN de live.py. Un proceso
+#   dedicado usa dos (LISTEN y trabajo).
+# - Un trabajo en_curso sin avances durante JOBS_STALE_SECONDS (worker caído) se vuelve
+#   a reclamar; tras JOBS_MAX_ATTEMPTS intentos fallidos o abandonados queda en 'error'.
+# - Reanudar un borrado a medias es seguro: cada lote borra lo que quede.
+import logging
+import os
+import select
+import threading
+import time
+
+import psycopg2
+
+import ledger
+import metrics
+import versions
+from models import PoolTimeout
+
+CHANNEL = 'trabajos'
+JOBS_BATCH_SIZE = int(os.environ.get('JOBS_BATCH_SIZE', 1000))
+JOBS_POLL_SECONDS = float(os.environ.get('JOBS_POLL_SECONDS', 30))
+JOBS_STALE_SECONDS = float(os.environ.get('JOBS_STALE_SECONDS', 300))
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 3))
+JOBS_IN_PROCESS = os.environ.get('JOBS_IN_PROCESS', '1') != '0'
+
+JOBS_FINISHED = metrics.Counter('jobs_finished_total', 'Trabajos terminados por tipo y estado.', ('tipo', 'estado'))
+JOBS_ROWS = metrics.Counter('jobs_deleted_rows_total', 'Compras borradas por los trabajos.', ('tipo',))
+
+log = logging.getLogger('gift_tracker.jobs')
+
+
+def enqueue(cur, tipo, objetivo):
+    # Se entrega a los workers (NOTIFY) al hacer commit la transacción de la ruta
+    cur.execute('''
+        WITH t AS (INSERT INTO trabajos (tipo, objetivo) VALUES (%s, %s) RETURNING id)
+        SELECT id, pg_notify(%s, id::text) FROM t
+    ''', (tipo, int(objetivo), CHANNEL))
+    return cur.fetchone()[0]
+
+
+def recent(cur, limite=50):
+    cur.execute('''
+        SELECT id, tipo, objetivo, estado, intentos, procesadas, error, creado, actualizado, terminado
+        FROM trabajos
+        ORDER BY id DESC
+        LIMIT %s
+    ''', (limite,))
+    columns = [c.name for c in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def claim(conn):
+    # Reclama el trabajo pendiente más antiguo (o uno abandonado) sin esperar a los
+    # que ya tiene otro worker. Devuelve (id, tipo, objetivo) o None.
+    cur = conn.cursor()
+    # Un abandonado que ya agotó sus intentos (el proceso muere siempre en él: OOM,
+    # timeout...) no se vuelve a reclamar: pasa a 'error'
+    cur.execute('''
+        UPDATE trabajos
+        SET estado = 'error', error = %s, actualizado = now(), terminado = now()
+        WHERE id IN (
+            SELECT id FROM trabajos
+            WHERE estado = 'en_curso' AND actualizado < now() - make_interval(secs => %s) AND intentos >= %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING tipo
+    ''', (f'Abandonado en {JOBS_MAX_ATTEMPTS} intentos (worker caído)', JOBS_STALE_SECONDS, JOBS_MAX_ATTEMPTS))
+    for (tipo,) in cur.fetchall():
+        JOBS_FINISHED.inc(tipo, 'error')
+    cur.execute('''
+        UPDATE trabajos
+        SET estado = 'en_curso', intentos = intentos + 1, error = NULL, actualizado = now()
+        WHERE id = (
+            SELECT id FROM trabajos
+            WHERE estado = 'pendiente'
+               OR (estado = 'en_curso' AND actualizado < now() - make_interval(secs => %s) AND intentos < %s)
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, tipo, objetivo
+    ''', (JOBS_STALE_SECONDS, JOBS_MAX_ATTEMPTS))
+    job = cur.fetchone()
+    conn.commit()
+    return job
+
+
+def _delete_in_batches(conn, job_id, tipo, evento_id=None, comprador_id=None):
+    cur = conn.cursor()
+    while True:
+        # Antes del borrado: los eventos afectados se localizan por sus saldos
+        versions.bump(cur, 'compras', evento_id=evento_id, comprador_id=comprador_id)
+        borradas = ledger.remove_purchases_batch(cur, JOBS_BATCH_SIZE, evento_id=evento_id, comprador_id=comprador_id)
+        cur.execute('UPDATE trabajos SET procesadas = procesadas + %s, actualizado = now() WHERE id = %s',
+                    (borradas, job_id))
+        conn.commit()
+        JOBS_ROWS.inc(tipo, amount=borradas)
+        if borradas < JOBS_BATCH_SIZE:
+            return
+
+
+def eliminar_evento(conn, job_id, evento_id):
+    _delete_in_batches(conn, job_id, 'eliminar_evento', evento_id=evento_id)
+    cur = conn.cursor()
+    versions.bump(cur, 'catalogo', 'compras')
+    cur.execute('DELETE FROM eventos WHERE id = %s', (evento_id,))
+
+
+def eliminar_usuario(conn, job_id, usuario_id):
+    # Sus compras y después las de los eventos asociados a él, que también se borran
+    _delete_in_batches(conn, job_id, 'eliminar_usuario', comprador_id=usuario_id)
+    cur = conn.cursor()
+    cur.execute('SELECT id FROM eventos WHERE usuario_id = %s ORDER BY id', (usuario_id,))
+    eventos = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    for evento_id in eventos:
+        _delete_in_batches(conn, job_id, 'eliminar_usuario', evento_id=evento_id)
+    versions.bump(cur, 'catalogo', 'compras')
+    cur.execute('DELETE FROM usuarios WHERE id = %s', (usuario_id,))
+
+
+HANDLERS = {
+    'eliminar_evento': eliminar_evento,
+    'eliminar_usuario': eliminar_usuario,
+}
+
+
+def run_one(conn):
+    # Ejecuta un trabajo. Devuelve False si no había ninguno pendiente.
+    job = claim(conn)
+    if job is None:
+        return False
+    job_id, tipo, objetivo = job
+    cur = conn.cursor()
+    try:
+        HANDLERS[tipo](conn, job_id, objetivo)
+        cur.execute('''
+            UPDATE trabajos SET estado = 'hecho', actualizado = now(), terminado = now() WHERE id = %s
+        ''', (job_id,))
+        conn.commit()
+        JOBS_FINISHED.inc(tipo, 'hecho')
+    except Exception as e:
+        conn.rollback()
+        log.exception('Trabajo %s (%s %s) fallido', job_id, tipo, objetivo)
+        cur.execute('''
+            UPDATE trabajos
+            SET estado = CASE WHEN intentos >= %s THEN 'error' ELSE 'pendiente' END,
+                error = %s, actualizado = now(),
+                terminado = CASE WHEN intentos >= %s THEN now() END
+            WHERE id = %s
+            RETURNING estado
+        ''', (JOBS_MAX_ATTEMPTS, f'{type(e).__name__}: {e}'[:500], JOBS_MAX_ATTEMPTS, job_id))
+        if cur.fetchone()[0] == 'error':
+            JOBS_FINISHED.inc(tipo, 'error')
+        conn.commit()
+    return True
+
+
+def run_pending(conn):
+    # Ejecuta trabajos hasta vaciar la cola. Devuelve cuántos se ejecutaron.
+    count = 0
+    while run_one(conn):
+        count += 1
+    return count
+
+
+class Worker:
+    # Hilo de un proceso web: ejecuta los trabajos con una conexión del pool cada vez
+    # que llega un aviso (wake(), desde la conexión LISTEN de live.Broadcaster) y, sin
+    # avisos, cada JOBS_POLL_SECONDS (trabajos abandonados)
+    def __init__(self, get_pool):
+        self._get_pool = get_pool
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def wake(self, payload=None):
+        self._wakeup.set()
+
+    def ensure_started(self):
+        # Un hilo por proceso: los hilos no sobreviven al fork de gunicorn.
+        # Se llama en cada petición, así que el caso habitual no toma el lock.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._wakeup = threading.Event()
+                threading.Thread(target=self.run, name='jobs-worker', daemon=True).start()
+
+    def run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                pool = self._get_pool()
+                conn = pool.getconn()
+                try:
+                    run_pending(conn)
+                finally:
+                    pool.putconn(conn)
+            except (psycopg2.Error, OSError, PoolTimeout):
+                log.exception('Worker de trabajos sin conexión; reintentando')
+                time.sleep(1)
+            self._wakeup.wait(JOBS_POLL_SECONDS)
+
+
+def run_forever(connect, channel=CHANNEL):
+    # Proceso dedicado (`flask --app app jobs-worker`): espera NOTIFY en una conexión y
+    # ejecuta los trabajos con otra
+    while True:
+        listen = conn = None
+        try:
+            listen = connect()
+            listen.autocommit = True
+            cur = listen.cursor()
+            cur.execute(f'LISTEN {channel}')
+            cur.close()
+            conn = connect()
+            while True:
+                run_pending(conn)
+                # Sin avisos se revisa igualmente cada JOBS_POLL_SECONDS (trabajos abandonados)
+                if select.select([listen], [], [], JOBS_POLL_SECONDS) != ([], [], []):
+                    listen.poll()
+                    listen.notifies.clear()
+        except (psycopg2.Error, OSError):
+            log.exception('Worker de trabajos sin conexión; reintentando')
+            time.sleep(1)
+        finally:
+            for c in (listen, conn):
+                if c is not None:
+                    try:
+                        c.close()
+                    except psycopg2.Error:
+                        pass
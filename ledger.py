@@ -0,0 +1,115 @@
+# Totales acumulados por (evento, usuario) en la tabla saldos. Se actualizan en la
+# misma transacción que el INSERT/DELETE de compras, de modo que las páginas de
+# cuentas leen O(participantes) filas en lugar de sumar todas las compras.
+# ultima_compra (id de la compra más reciente del usuario en el evento) sirve para
+# ordenar; se obtiene del índice (evento_id, comprador_id, id) de compras.
+# Los borrados de eventos y usuarios los hace jobs.py por lotes con
+# remove_purchases_batch(), que descuenta los saldos de cada lote; ON DELETE CASCADE
+# solo limpia las filas ya a cero al borrar el evento o el usuario.
+import psycopg2.extras
+
+COMPUTED_SQL = '''
+    SELECT evento_id, comprador_id AS usuario_id, SUM(monto) AS total, COUNT(*) AS num_compras,
+           MAX(id) AS ultima_compra
+    FROM compras
+    GROUP BY evento_id, comprador_id
+'''
+
+# Id de la compra más reciente del usuario en el evento, ya con el INSERT/DELETE hecho
+ULTIMA_COMPRA_SQL = '(SELECT MAX(id) FROM compras WHERE evento_id = %s AND comprador_id = %s)'
+
+
+def add_purchase(cur, evento_id, usuario_id, monto):
+    cur.execute(f'''
+        INSERT INTO saldos (evento_id, usuario_id, total, num_compras, ultima_compra)
+        VALUES (%s, %s, %s, 1, {ULTIMA_COMPRA_SQL})
+        ON CONFLICT (evento_id, usuario_id) DO UPDATE
+        SET total = saldos.total + EXCLUDED.total,
+            num_compras = saldos.num_compras + 1,
+            ultima_compra = GREATEST(saldos.ultima_compra, EXCLUDED.ultima_compra)
+    ''', (evento_id, usuario_id, monto, evento_id, usuario_id))
+
+
+def add_purchases(cur, evento_id, totals):
+    # totals: {usuario_id: (total, num_compras)} de una carga masiva
+    psycopg2.extras.execute_values(cur, '''
+        INSERT INTO saldos (evento_id, usuario_id, total, num_compras, ultima_compra)
+        VALUES %s
+        ON CONFLICT (evento_id, usuario_id) DO UPDATE
+        SET total = saldos.total + EXCLUDED.total,
+            num_compras = saldos.num_compras + EXCLUDED.num_compras,
+            ultima_compra = GREATEST(saldos.ultima_compra, EXCLUDED.ultima_compra)
+    ''', [(evento_id, usuario_id, total, n, evento_id, usuario_id) for usuario_id, (total, n) in totals.items()],
+        template=f'(%s, %s, %s, %s, {ULTIMA_COMPRA_SQL})')
+
+
+def remove_purchase(cur, evento_id, usuario_id, monto):
+    cur.execute(f'''
+        UPDATE saldos
+        SET total = total - %s, num_compras = num_compras - 1, ultima_compra = {ULTIMA_COMPRA_SQL}
+        WHERE evento_id = %s AND usuario_id = %s
+    ''', (monto, evento_id, usuario_id, evento_id, usuario_id))
+    cur.execute('DELETE FROM saldos WHERE evento_id = %s AND usuario_id = %s AND num_compras <= 0', (evento_id, usuario_id))
+
+
+def remove_purchases_batch(cur, limite, evento_id=None, comprador_id=None):
+    # Borra hasta `limite` compras de un evento (o de un comprador) y descuenta sus
+    # saldos en la misma transacción. Devuelve cuántas compras se borraron.
+    # ultima_compra no se recalcula: son compras de un evento o usuario ya oculto.
+    columna, valor = ('evento_id', evento_id) if evento_id is not None else ('comprador_id', comprador_id)
+    cur.execute(f'''
+        WITH borradas AS (
+            DELETE FROM compras
+            WHERE id IN (SELECT id FROM compras WHERE {columna} = %s LIMIT %s)
+            RETURNING evento_id, comprador_id, monto
+        ), suma AS (
+            SELECT evento_id, comprador_id, SUM(monto) AS total, COUNT(*) AS n
+            FROM borradas
+            GROUP BY evento_id, comprador_id
+        ), actualizados AS (
+            UPDATE saldos s
+            SET total = s.total - suma.total, num_compras = s.num_compras - suma.n
+            FROM suma
+            WHERE s.evento_id = suma.evento_id AND s.usuario_id = suma.comprador_id
+        )
+        SELECT COALESCE(SUM(n), 0) FROM suma
+    ''', (valor, limite))
+    borradas = cur.fetchone()[0]
+    cur.execute(f'DELETE FROM saldos WHERE {"evento_id" if evento_id is not None else "usuario_id"} = %s AND num_compras <= 0',
+                (valor,))
+    return borradas
+
+
+def verify(conn):
+    # Devuelve las filas en las que saldos no coincide con la suma real de compras
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT COALESCE(r.evento_id, s.evento_id), COALESCE(r.usuario_id, s.usuario_id),
+               r.total, s.total, r.num_compras, s.num_compras
+        FROM ({COMPUTED_SQL}) r
+        FULL OUTER JOIN saldos s ON s.evento_id = r.evento_id AND s.usuario_id = r.usuario_id
+        WHERE r.total IS DISTINCT FROM s.total OR r.num_compras IS DISTINCT FROM s.num_compras
+        ORDER BY 1, 2
+    ''')
+    mismatches = cur.fetchall()
+    conn.rollback()
+    cur.close()
+    return mismatches
+
+
+def rebuild(conn):
+    # Recalcula saldos desde cero. El bloqueo SHARE sobre compras impide
+    # altas y bajas concurrentes mientras dura la reconstrucción.
+    cur = conn.cursor()
+    try:
+        cur.execute('LOCK TABLE compras IN SHARE MODE')
+        cur.execute('DELETE FROM saldos')
+        cur.execute(f'INSERT INTO saldos (evento_id, usuario_id, total, num_compras, ultima_compra) {COMPUTED_SQL}')
+        rows = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return rows
@@ -0,0 +1,173 @@
+# Actualizaciones en directo de las compras de un evento.
+# Las rutas de escritura publican con pg_notify (se entrega al hacer commit) y cada
+# worker mantiene una única conexión LISTEN en un hilo que reparte los mensajes
+# entre los clientes SSE suscritos a ese evento. La misma conexión escucha otros
+# canales con su propio manejador (los avisos de la cola de trabajos, ver jobs.py).
+# El streaming necesita workers con hilos (gunicorn --worker-class gthread) y cada
+# stream ocupa un hilo mientras dura: como mucho SSE_MAX_STREAMS por worker, el resto
+# recibe 503 y la página sigue funcionando sin directo. Hilos necesarios por worker:
+# DB_POOL_MAX (peticiones normales) + SSE_MAX_STREAMS (ver Procfile).
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+
+CHANNEL = 'compras'
+# Duración máxima de una conexión SSE; el navegador reconecta solo al cerrarse
+SSE_MAX_SECONDS = float(os.environ.get('SSE_MAX_SECONDS', 300))
+SSE_HEARTBEAT_SECONDS = 15
+# Streams abiertos a la vez por worker
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 4))
+# Segundos que espera la página antes de reintentar cuando no hay hueco (add_purchase.html)
+SSE_BUSY_RETRY_SECONDS = 30
+# Mensajes pendientes por cliente; si un cliente lento la llena se descartan
+SUBSCRIBER_QUEUE_SIZE = 100
+# Espera máxima en subscribe() a que el hilo haya ejecutado LISTEN (base de datos caída)
+LISTEN_READY_TIMEOUT = 5
+
+log = logging.getLogger('gift_tracker.live')
+
+
+class StreamsBusy(Exception):
+    pass
+
+
+def notify(cur, tipo, evento_id, comprador, compra=None):
+    # tipo: 'nueva', 'eliminada' o 'importacion'. Incluye los totales ya actualizados
+    # en saldos (misma transacción) para que la página no tenga que consultarlos.
+    if compra is not None:
+        compra = dict(compra, descripcion=compra['descripcion'][:200])
+    cur.execute('''
+        SELECT pg_notify(%s, json_build_object(
+            'tipo', %s,
+            'evento_id', %s,
+            'comprador', %s,
+            'compra', %s::json,
+            'total_comprador', COALESCE((SELECT total FROM saldos s JOIN usuarios u ON u.id = s.usuario_id
+                                         WHERE s.evento_id = %s AND u.username = %s), 0),
+            'total_evento', COALESCE((SELECT SUM(total) FROM saldos s JOIN usuarios u ON u.id = s.usuario_id
+                                      WHERE s.evento_id = %s AND NOT u.eliminado), 0)
+        )::text)
+    ''', (CHANNEL, tipo, int(evento_id), comprador, json.dumps(compra), int(evento_id), comprador, int(evento_id)))
+
+
+class Broadcaster:
+    def __init__(self, connect, channel=CHANNEL, handlers=None):
+        self._connect = connect
+        self.channel = channel
+        # Otros canales escuchados con la misma conexión: canal -> función(payload)
+        self.handlers = dict(handlers or {})
+        self._subscribers = {}  # evento_id -> set de colas
+        self._lock = threading.Lock()
+        self._pid = None
+        # Activo mientras la conexión LISTEN está escuchando
+        self._ready = threading.Event()
+
+    def _ensure_listener(self):
+        # Un hilo por proceso: los hilos no sobreviven al fork de gunicorn
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._subscribers = {}
+            self._ready = threading.Event()
+            threading.Thread(target=self._listen, name='pg-listen', daemon=True).start()
+
+    def ensure_started(self):
+        # Para los manejadores de otros canales, que no esperan a un cliente SSE
+        with self._lock:
+            self._ensure_listener()
+
+    def subscribe(self, evento_id, limit=None):
+        # Con `limit`, StreamsBusy si este worker ya tiene ese número de suscritos
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._ensure_listener()
+            if limit is not None and sum(len(s) for s in self._subscribers.values()) >= limit:
+                raise StreamsBusy()
+            self._subscribers.setdefault(evento_id, set()).add(q)
+        # Sin esto los avisos enviados justo después de la primera suscripción del
+        # worker se perderían: NOTIFY solo llega a quien ya ha hecho LISTEN
+        self._ready.wait(LISTEN_READY_TIMEOUT)
+        return q
+
+    def unsubscribe(self, evento_id, q):
+        with self._lock:
+            subs = self._subscribers.get(evento_id)
+            if subs:
+                subs.discard(q)
+                if not subs:
+                    del self._subscribers[evento_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def _dispatch(self, payload):
+        try:
+            evento_id = json.loads(payload)['evento_id']
+        except (ValueError, KeyError, TypeError):
+            return
+        with self._lock:
+            subs = list(self._subscribers.get(evento_id, ()))
+        for q in subs:
+            try:
+                q.put_nowait(payload)
+            except queue.Full:
+                pass
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                cur = conn.cursor()
+                for channel in (self.channel, *self.handlers):
+                    cur.execute(f'LISTEN {channel}')
+                cur.close()
+                self._ready.set()
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        handler = self.handlers.get(notify.channel)
+                        if handler is None:
+                            self._dispatch(notify.payload)
+                        else:
+                            handler(notify.payload)
+            except (psycopg2.Error, OSError):
+                self._ready.clear()
+                log.exception('Conexión LISTEN perdida; reintentando')
+                time.sleep(1)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+
+
+def sse_stream(broadcaster, evento_id, q):
+    # Generador independiente del contexto de Flask: la conexión de la petición
+    # vuelve al pool antes de empezar a emitir
+    try:
+        yield 'retry: 3000\n\n'
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                payload = q.get(timeout=min(SSE_HEARTBEAT_SECONDS, remaining))
+            except queue.Empty:
+                yield ': ping\n\n'
+                continue
+            yield f'event: compra\ndata: {payload}\n\n'
+    finally:
+        broadcaster.unsubscribe(evento_id, q)
@@ -0,0 +1,177 @@
+# Métricas en memoria del proceso en formato de texto de Prometheus.
+# Cada worker de gunicorn lleva sus propios contadores: /metrics devuelve los del
+# worker que atiende la petición.
+import logging
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask import before_render_template, template_rendered
+
+# Consultas más lentas que este umbral (ms) se escriben en el log; 0 lo desactiva
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+
+slow_query_log = logging.getLogger('gift_tracker.slow_query')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with _lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}  # labels -> [cuentas por bucket..., suma, total]
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        with _lock:
+            data = self._values.get(labels)
+            if data is None:
+                data = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def snapshot(self, *labels):
+        # (suma, número de observaciones) para unas etiquetas concretas
+        with _lock:
+            data = self._values.get(labels)
+            return (data[-2], data[-1]) if data else (0, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.labelnames + ('le',)
+        for labels, data in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, data):
+                lines.append(f'{self.name}_bucket{_format_labels(names, labels + (bound,))} {count}')
+            lines.append(f'{self.name}_bucket{_format_labels(names, labels + ("+Inf",))} {data[-1]}')
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{suffix} {data[-2]}')
+            lines.append(f'{self.name}_count{suffix} {data[-1]}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Duración de las peticiones por endpoint.',
+    ('endpoint', 'method', 'status'))
+REQUEST_QUERIES = Histogram(
+    'http_request_queries', 'Consultas SQL ejecutadas por petición.',
+    ('endpoint',), COUNT_BUCKETS)
+REQUEST_QUERY_SECONDS = Histogram(
+    'http_request_query_seconds', 'Tiempo total en consultas SQL por petición.',
+    ('endpoint',))
+QUERY_SECONDS = Histogram('db_query_duration_seconds', 'Duración de cada consulta SQL.')
+SLOW_QUERIES = Counter('db_slow_queries_total', 'Consultas por encima de SLOW_QUERY_MS.')
+CONNECTION_ACQUIRE_SECONDS = Histogram(
+    'db_connection_acquire_seconds', 'Tiempo para obtener una conexión del pool.')
+TEMPLATE_SECONDS = Histogram(
+    'template_render_seconds', 'Tiempo de renderizado por plantilla.', ('template',))
+
+
+def _sql_text(sql):
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    return ' '.join(str(sql).split())[:500]
+
+
+def record_query(sql, seconds):
+    QUERY_SECONDS.observe(seconds)
+    if has_request_context():
+        g.metrics_queries = g.get('metrics_queries', 0) + 1
+        g.metrics_query_seconds = g.get('metrics_query_seconds', 0.0) + seconds
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc()
+        slow_query_log.warning('Consulta lenta (%.1f ms): %s', seconds * 1000, _sql_text(sql))
+
+
+def query_budget(max_queries):
+    # Declara el máximo de consultas SQL que puede ejecutar una ruta (con la caché
+    # de usuarios caliente). tests/test_query_budgets.py lo comprueba en cada ruta.
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+
+
+def _after_request(response):
+    start = g.get('metrics_start')
+    if start is not None:
+        endpoint = request.endpoint or 'none'
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, request.method, response.status_code)
+        REQUEST_QUERIES.observe(g.get('metrics_queries', 0), endpoint)
+        REQUEST_QUERY_SECONDS.observe(g.get('metrics_query_seconds', 0.0), endpoint)
+    return response
+
+
+def _before_render(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('metrics_render_start', []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    if has_request_context() and g.get('metrics_render_start'):
+        TEMPLATE_SECONDS.observe(time.perf_counter() - g.metrics_render_start.pop(), template.name or 'string')
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+
+
+def render(gauges=()):
+    # gauges: iterable de (nombre, ayuda, valor) con valores instantáneos a añadir
+    with _lock:
+        lines = []
+        for metric in _registry:
+            lines.extend(metric.render())
+    for name, help, value in gauges:
+        lines.extend([f'# HELP {name} {help}', f'# TYPE {name} gauge', f'{name} {value}'])
+    return '\n'.join(lines) + '\n'
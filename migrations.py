@@ -0,0 +1,164 @@
+# Migraciones de esquema numeradas. Se aplican en orden con `flask --app app migrate`
+# (o models.init_db()) y nunca al importar la app, para que los workers arranquen rápido.
+# Para cambiar el esquema, añadir una nueva entrada al final; no editar las ya aplicadas.
+
+MIGRATIONS = [
+    (1, 'tablas iniciales', '''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS eventos (
+            id SERIAL PRIMARY KEY,
+            nombre VARCHAR(100) NOT NULL UNIQUE,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS compras (
+            id SERIAL PRIMARY KEY,
+            evento_id INTEGER NOT NULL REFERENCES eventos(id) ON DELETE CASCADE,
+            comprador_id INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE CASCADE,
+            destinatario VARCHAR(50) NOT NULL,
+            descripcion TEXT NOT NULL,
+            monto DECIMAL(10, 2) NOT NULL
+        );
+    '''),
+    (2, 'índices de compras y eventos', '''
+        -- Filtros por evento y comprador, y paginación por id dentro de ellos
+        CREATE INDEX IF NOT EXISTS compras_evento_comprador_idx ON compras (evento_id, comprador_id, id);
+        -- Agregados globales por comprador y ON DELETE CASCADE desde usuarios
+        CREATE INDEX IF NOT EXISTS compras_comprador_idx ON compras (comprador_id);
+        -- Listado del dashboard (eventos de otros usuarios ordenados por nombre)
+        CREATE INDEX IF NOT EXISTS eventos_usuario_nombre_idx ON eventos (usuario_id, nombre);
+    '''),
+    (3, 'saldos acumulados por evento y usuario', '''
+        CREATE TABLE IF NOT EXISTS saldos (
+            evento_id INTEGER NOT NULL REFERENCES eventos(id) ON DELETE CASCADE,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE CASCADE,
+            total DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            num_compras INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (evento_id, usuario_id)
+        );
+        CREATE INDEX IF NOT EXISTS saldos_usuario_idx ON saldos (usuario_id);
+
+        INSERT INTO saldos (evento_id, usuario_id, total, num_compras)
+        SELECT evento_id, comprador_id, SUM(monto), COUNT(*)
+        FROM compras
+        GROUP BY evento_id, comprador_id
+        ON CONFLICT DO NOTHING;
+    '''),
+    (4, 'versiones de datos para GET condicionales', '''
+        ALTER TABLE eventos
+            ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1,
+            ADD COLUMN IF NOT EXISTS modificado TIMESTAMPTZ NOT NULL DEFAULT now();
+
+        CREATE TABLE IF NOT EXISTS versiones (
+            nombre TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 1,
+            modificado TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        INSERT INTO versiones (nombre) VALUES ('catalogo'), ('compras') ON CONFLICT DO NOTHING;
+    '''),
+    (5, 'búsqueda por trigramas en eventos y usuarios', '''
+        -- Búsqueda por prefijo (ILIKE 'x%') y aproximada (%) en los listados paginados,
+        -- con índices GIN de pg_trgm. La paginación por nombre usa los índices UNIQUE.
+        -- coincide_busqueda() es SQL simple y STABLE: el planificador la expande en la
+        -- consulta y puede usar los índices. Si el servidor no tiene pg_trgm (contrib)
+        -- se queda solo con la búsqueda por prefijo.
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                CREATE INDEX IF NOT EXISTS eventos_nombre_trgm_idx ON eventos USING gin (nombre gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS usuarios_username_trgm_idx ON usuarios USING gin (username gin_trgm_ops);
+                CREATE OR REPLACE FUNCTION coincide_busqueda(texto TEXT, q TEXT, prefijo TEXT) RETURNS BOOLEAN
+                    LANGUAGE sql STABLE AS $f$ SELECT texto ILIKE prefijo OR texto % q $f$;
+            ELSE
+                CREATE OR REPLACE FUNCTION coincide_busqueda(texto TEXT, q TEXT, prefijo TEXT) RETURNS BOOLEAN
+                    LANGUAGE sql STABLE AS $f$ SELECT texto ILIKE prefijo $f$;
+            END IF;
+        END
+        $$;
+    '''),
+    (6, 'cola de trabajos para borrados en cascada', '''
+        -- Los eventos y usuarios borrados se ocultan al momento (eliminado) y un trabajo
+        -- en segundo plano borra sus compras por lotes (ver jobs.py)
+        ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS eliminado BOOLEAN NOT NULL DEFAULT false;
+        ALTER TABLE eventos ADD COLUMN IF NOT EXISTS eliminado BOOLEAN NOT NULL DEFAULT false;
+
+        CREATE TABLE IF NOT EXISTS trabajos (
+            id BIGSERIAL PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            objetivo INTEGER NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'pendiente'
+                CHECK (estado IN ('pendiente', 'en_curso', 'hecho', 'error')),
+            intentos INTEGER NOT NULL DEFAULT 0,
+            procesadas BIGINT NOT NULL DEFAULT 0,
+            error TEXT,
+            creado TIMESTAMPTZ NOT NULL DEFAULT now(),
+            actualizado TIMESTAMPTZ NOT NULL DEFAULT now(),
+            terminado TIMESTAMPTZ
+        );
+        -- Los workers solo recorren los trabajos sin terminar
+        CREATE INDEX IF NOT EXISTS trabajos_activos_idx ON trabajos (id) WHERE estado IN ('pendiente', 'en_curso');
+    '''),
+    (7, 'índice de compras por evento e id', '''
+        -- La exportación de un evento (ORDER BY id) recorre el índice en orden y empieza
+        -- a enviar filas sin esperar a ordenar todas las compras
+        CREATE INDEX IF NOT EXISTS compras_evento_id_idx ON compras (evento_id, id);
+    '''),
+    (8, 'última compra en saldos', '''
+        -- La página del evento ordena a los compradores por su compra más reciente
+        -- leyendo solo saldos (ver ledger.py)
+        ALTER TABLE saldos ADD COLUMN IF NOT EXISTS ultima_compra INTEGER;
+        UPDATE saldos s SET ultima_compra = (
+            SELECT MAX(c.id) FROM compras c WHERE c.evento_id = s.evento_id AND c.comprador_id = s.usuario_id
+        );
+    '''),
+]
+
+# Clave arbitraria para pg_advisory_xact_lock: evita que dos procesos migren a la vez
+MIGRATION_LOCK_ID = 727364
+
+
+def current_version(conn):
+    cur = conn.cursor()
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            aplicada_en TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    ''')
+    cur.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    version = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return version
+
+
+def migrate(conn):
+    # Aplica las migraciones pendientes, cada una en su propia transacción.
+    # Devuelve la lista de (versión, nombre) aplicadas.
+    current_version(conn)
+    applied = []
+    for version, nombre, sql in MIGRATIONS:
+        cur = conn.cursor()
+        try:
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+            cur.execute('SELECT 1 FROM schema_version WHERE version = %s', (version,))
+            if cur.fetchone():
+                conn.rollback()
+                continue
+            cur.execute(sql)
+            cur.execute('INSERT INTO schema_version (version, nombre) VALUES (%s, %s)', (version, nombre))
+            conn.commit()
+            applied.append((version, nombre))
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+    return applied
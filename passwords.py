@@ -0,0 +1,78 @@
+# Hash y verificación de contraseñas en un pool de hilos acotado. bcrypt libera el
+# GIL, así que los hilos del pool trabajan en paralelo sin bloquear al resto del
+# worker; si hay demasiadas operaciones en cola se rechaza al instante (PasswordPoolBusy)
+# en lugar de acumular peticiones detrás de un pico de logins.
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', 2))
+PASSWORD_MAX_PENDING = int(os.environ.get('PASSWORD_MAX_PENDING', 8))
+
+PASSWORD_SECONDS = metrics.Histogram(
+    'password_hash_seconds', 'Duración de las operaciones bcrypt (incluida la espera en cola).', ('op',))
+PASSWORD_REJECTED = metrics.Counter(
+    'password_rejected_total', 'Operaciones bcrypt rechazadas por pool saturado.')
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+def hash_cost(password_hash):
+    # '$2b$12$...' -> 12
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, bcrypt, log_rounds, workers=2, max_pending=8):
+        self.bcrypt = bcrypt
+        self.log_rounds = log_rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Los hilos no sobreviven al fork de gunicorn: un executor por proceso
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+                    self._slots = threading.BoundedSemaphore(self.workers + self.max_pending)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, op, fn, *args):
+        executor = self._pool()
+        if not self._slots.acquire(blocking=False):
+            PASSWORD_REJECTED.inc()
+            raise PasswordPoolBusy()
+        start = time.perf_counter()
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result()
+        finally:
+            PASSWORD_SECONDS.observe(time.perf_counter() - start, op)
+
+    def hash(self, password):
+        return self._run('hash', self.bcrypt.generate_password_hash, password).decode('utf-8')
+
+    def verify(self, password_hash, password):
+        return self._run('verify', self.bcrypt.check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return hash_cost(password_hash) != self.log_rounds
@@ -0,0 +1,408 @@
+# Acceso a datos de usuarios, eventos, compras y saldos: las consultas de las rutas
+# en un solo sitio, devolviendo filas compactas con __slots__ en lugar de DictRow.
+# - PostgresRepository prepara cada sentencia en el servidor la primera vez que se usa
+#   en una conexión (PREPARE) y después solo la ejecuta (EXECUTE); las conexiones del
+#   pool conservan lo preparado entre peticiones. DB_PREPARED_STATEMENTS=0 lo desactiva
+#   (p. ej. detrás de pgbouncer en modo transacción).
+# - SqliteRepository implementa lo mismo en memoria para tests y pruebas locales sin
+#   Postgres. Las versiones, NOTIFY, COPY, réplicas y la cola de trabajos siguen siendo
+#   solo de Postgres.
+# No hace commit: la ruta decide el final de la transacción (repo.commit()).
+import os
+import re
+import sqlite3
+
+import psycopg2
+import psycopg2.extensions
+
+import ledger
+
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') != '0'
+
+
+class Row:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        # Las columnas que la consulta no trae quedan a None
+        for i, name in enumerate(self.__slots__):
+            setattr(self, name, values[i] if i < len(values) else None)
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class Usuario(Row):
+    __slots__ = ('id', 'username')
+
+
+class Credenciales(Row):
+    __slots__ = ('id', 'username', 'password_hash')
+
+
+class Evento(Row):
+    __slots__ = ('id', 'nombre', 'usuario_id', 'usuario_evento')
+
+
+class Compra(Row):
+    __slots__ = ('id', 'descripcion', 'destinatario', 'monto')
+
+
+class CompraBorrada(Row):
+    __slots__ = ('id', 'evento_id', 'descripcion', 'monto')
+
+
+class TotalComprador(Row):
+    __slots__ = ('comprador_id', 'username', 'total')
+
+
+class Aportacion(Row):
+    __slots__ = ('username', 'total_aportado')
+
+
+# Sentencias con parámetros $1, $2... (PREPARE en Postgres, ?1, ?2... en SQLite)
+STATEMENTS = {
+    # Los usuarios y eventos con eliminado = true esperan a que jobs.py los borre: ya no existen
+    'usuario': 'SELECT id, username FROM usuarios WHERE id = $1 AND NOT eliminado',
+    'credenciales': 'SELECT id, username, password_hash FROM usuarios WHERE username = $1 AND NOT eliminado',
+    'crear_usuario': 'INSERT INTO usuarios (username, password_hash) VALUES ($1, $2) RETURNING id',
+    'actualizar_hash': 'UPDATE usuarios SET password_hash = $2 WHERE id = $1',
+    'borrar_usuario': 'DELETE FROM usuarios WHERE id = $1',
+    'ocultar_usuario': 'UPDATE usuarios SET eliminado = true WHERE id = $1 AND NOT eliminado RETURNING id',
+    # Paginación keyset por nombre: la primera página empieza en '' (todo nombre es
+    # mayor). Con búsqueda es otra sentencia (ver coincide_busqueda en la migración 5):
+    # tras 5 EXECUTE Postgres pasa a un plan genérico, y un `$1 = '' OR ...` o un
+    # `$3 IS NULL OR ...` lo dejaría sin poder usar los índices.
+    'pagina_usuarios': '''
+        SELECT id, username FROM usuarios
+        WHERE NOT eliminado AND username > $1
+        ORDER BY username
+        LIMIT $2
+    ''',
+    'buscar_usuarios': '''
+        SELECT id, username FROM usuarios
+        WHERE NOT eliminado AND coincide_busqueda(username, $1, $2) AND username > $3
+        ORDER BY username
+        LIMIT $4
+    ''',
+    'evento': '''
+        SELECT e.id, e.nombre, e.usuario_id, u.username
+        FROM eventos e
+        JOIN usuarios u ON u.id = e.usuario_id
+        WHERE e.id = $1 AND NOT e.eliminado AND NOT u.eliminado
+    ''',
+    'crear_evento': 'INSERT INTO eventos (nombre, usuario_id) VALUES ($1, $2) RETURNING id',
+    'borrar_evento': 'DELETE FROM eventos WHERE id = $1',
+    'ocultar_evento': 'UPDATE eventos SET eliminado = true WHERE id = $1 AND NOT eliminado RETURNING id',
+    # Los eventos de un usuario eliminado se borran con él. $1: usuario excluido (0 = ninguno)
+    'pagina_eventos': '''
+        SELECT e.id, e.nombre FROM eventos e
+        JOIN usuarios u ON u.id = e.usuario_id
+        WHERE NOT e.eliminado AND NOT u.eliminado AND e.usuario_id != $1 AND e.nombre > $2
+        ORDER BY e.nombre
+        LIMIT $3
+    ''',
+    'buscar_eventos': '''
+        SELECT e.id, e.nombre FROM eventos e
+        JOIN usuarios u ON u.id = e.usuario_id
+        WHERE NOT e.eliminado AND NOT u.eliminado AND e.usuario_id != $1
+          AND coincide_busqueda(e.nombre, $2, $3) AND e.nombre > $4
+        ORDER BY e.nombre
+        LIMIT $5
+    ''',
+    # Compras del usuario en un evento, por id descendente (keyset con ?antes=<id>)
+    'compras_usuario': '''
+        SELECT id, descripcion, destinatario, monto
+        FROM compras
+        WHERE evento_id = $1 AND comprador_id = $2
+        ORDER BY id DESC
+        LIMIT $3
+    ''',
+    'compras_usuario_antes': '''
+        SELECT id, descripcion, destinatario, monto
+        FROM compras
+        WHERE evento_id = $1 AND comprador_id = $2 AND id < $3
+        ORDER BY id DESC
+        LIMIT $4
+    ''',
+    'agregar_compra': '''
+        INSERT INTO compras (evento_id, comprador_id, destinatario, descripcion, monto)
+        VALUES ($1, $2, $3, $4, $5)
+        RETURNING id, descripcion, destinatario, monto
+    ''',
+    'borrar_compra': '''
+        DELETE FROM compras WHERE id = $1 AND comprador_id = $2
+        RETURNING id, evento_id, descripcion, monto
+    ''',
+    # Totales por comprador de un evento (ordenados por su compra más reciente)
+    'totales_evento': '''
+        SELECT s.usuario_id, u.username, s.total
+        FROM saldos s
+        JOIN usuarios u ON u.id = s.usuario_id
+        WHERE s.evento_id = $1 AND NOT u.eliminado
+        ORDER BY s.ultima_compra DESC
+    ''',
+    # Aportaciones de todos los usuarios excepto 'admin', leídas de saldos. Los saldos de
+    # un evento oculto (o de un usuario oculto, que se lleva sus eventos) dejan de contar
+    # al ocultarlo, no lote a lote mientras se borra
+    'aportaciones_total': '''
+        SELECT u.username, COALESCE(SUM(s.total), 0) AS total_aportado
+        FROM usuarios u
+        LEFT JOIN (saldos s
+                   JOIN eventos e ON e.id = s.evento_id AND NOT e.eliminado
+                   JOIN usuarios o ON o.id = e.usuario_id AND NOT o.eliminado) ON s.usuario_id = u.id
+        WHERE u.username != 'admin' AND NOT u.eliminado
+        GROUP BY u.username
+        ORDER BY u.username
+    ''',
+    # ... de un evento, sin 'admin' ni el usuario asociado al evento
+    'aportaciones_evento': '''
+        SELECT u.username, COALESCE(s.total, 0) AS total_aportado
+        FROM usuarios u
+        LEFT JOIN saldos s ON s.usuario_id = u.id AND s.evento_id = $1
+        WHERE u.username != 'admin' AND u.username != $2 AND NOT u.eliminado
+        ORDER BY u.username
+    ''',
+}
+
+_PLACEHOLDER = re.compile(r'\$(\d+)')
+
+
+def patron_prefijo(q):
+    return q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+class Repository:
+    IntegrityError = Exception
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _run(self, name, params):
+        raise NotImplementedError
+
+    def _one(self, name, params, row_class):
+        row = self._run(name, params).fetchone()
+        return row_class(*row) if row else None
+
+    def _all(self, name, params, row_class):
+        return [row_class(*row) for row in self._run(name, params).fetchall()]
+
+    def _pagina(self, name, params, row_class, limite, clave):
+        # Pide una fila de más para saber si hay página siguiente
+        filas = self._all(name, params + (limite + 1,), row_class)
+        if len(filas) > limite:
+            return filas[:limite], getattr(filas[limite - 1], clave)
+        return filas, None
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    # Usuarios
+    def usuario(self, usuario_id):
+        return self._one('usuario', (int(usuario_id),), Usuario)
+
+    def credenciales(self, username):
+        return self._one('credenciales', (username,), Credenciales)
+
+    def crear_usuario(self, username, password_hash):
+        return self._run('crear_usuario', (username, password_hash)).fetchone()[0]
+
+    def actualizar_hash(self, usuario_id, password_hash):
+        self._run('actualizar_hash', (usuario_id, password_hash))
+
+    def borrar_usuario(self, usuario_id):
+        self._run('borrar_usuario', (usuario_id,))
+
+    def ocultar_usuario(self, usuario_id):
+        # Devuelve False si ya estaba oculto (borrado pendiente)
+        return self._run('ocultar_usuario', (int(usuario_id),)).fetchone() is not None
+
+    def pagina_usuarios(self, q='', despues=None, limite=50):
+        # Devuelve (usuarios, nombre desde el que empieza la página siguiente o None)
+        if q:
+            return self._pagina('buscar_usuarios', (q, patron_prefijo(q), despues or ''), Usuario, limite, 'username')
+        return self._pagina('pagina_usuarios', (despues or '',), Usuario, limite, 'username')
+
+    # Eventos
+    def evento(self, evento_id):
+        return self._one('evento', (int(evento_id),), Evento)
+
+    def crear_evento(self, nombre, usuario_id):
+        return self._run('crear_evento', (nombre, int(usuario_id))).fetchone()[0]
+
+    def borrar_evento(self, evento_id):
+        self._run('borrar_evento', (int(evento_id),))
+
+    def ocultar_evento(self, evento_id):
+        return self._run('ocultar_evento', (int(evento_id),)).fetchone() is not None
+
+    def pagina_eventos(self, q='', despues=None, excluir_usuario=None, limite=50):
+        excluir_usuario = excluir_usuario or 0
+        if q:
+            params = (excluir_usuario, q, patron_prefijo(q), despues or '')
+            return self._pagina('buscar_eventos', params, Evento, limite, 'nombre')
+        return self._pagina('pagina_eventos', (excluir_usuario, despues or ''), Evento, limite, 'nombre')
+
+    # Compras (con sus saldos en la misma transacción)
+    def compras_usuario(self, evento_id, comprador_id, antes=None, limite=None):
+        name, params = 'compras_usuario', (int(evento_id), comprador_id)
+        if antes is not None:
+            name, params = 'compras_usuario_antes', params + (antes,)
+        if limite is None:
+            return self._all(name, params + (self._SIN_LIMITE,), Compra)
+        return self._pagina(name, params, Compra, limite, 'id')
+
+    def agregar_compra(self, evento_id, comprador_id, destinatario, descripcion, monto):
+        compra = self._one('agregar_compra', (int(evento_id), comprador_id, destinatario, descripcion, monto), Compra)
+        self._sumar_saldo(int(evento_id), comprador_id, compra.monto)
+        return compra
+
+    def borrar_compra(self, compra_id, comprador_id):
+        borrada = self._one('borrar_compra', (compra_id, comprador_id), CompraBorrada)
+        if borrada:
+            self._restar_saldo(borrada.evento_id, comprador_id, borrada.monto)
+        return borrada
+
+    # Saldos
+    def totales_evento(self, evento_id):
+        return self._all('totales_evento', (int(evento_id),), TotalComprador)
+
+    def aportaciones_total(self):
+        return self._all('aportaciones_total', (), Aportacion)
+
+    def aportaciones_evento(self, evento_id, usuario_evento):
+        return self._all('aportaciones_evento', (int(evento_id), usuario_evento), Aportacion)
+
+
+class PostgresRepository(Repository):
+    IntegrityError = psycopg2.IntegrityError
+    _SIN_LIMITE = None
+
+    def __init__(self, conn, prepare=DB_PREPARED_STATEMENTS):
+        super().__init__(conn)
+        self.prepare = prepare
+        self._cur = None
+
+    def cursor(self):
+        # Cursor para lo que no pasa por el repositorio (versions.bump, live.notify...)
+        if self._cur is None or self._cur.closed:
+            self._cur = self.conn.cursor()
+        return self._cur
+
+    def _run(self, name, params):
+        cur = self.cursor()
+        prepared = getattr(self.conn, 'prepared', None)
+        if not self.prepare or prepared is None:
+            cur.execute(_PLACEHOLDER.sub(r'%(\1)s', STATEMENTS[name]),
+                        {str(i): value for i, value in enumerate(params, 1)})
+            return cur
+        if name not in prepared:
+            # Cursor sin instrumentar: preparar no cuenta como consulta de la petición.
+            # PREPARE no es transaccional: sobrevive a rollbacks y dura lo que la conexión.
+            psycopg2.extensions.cursor(self.conn).execute(f'PREPARE repo_{name} AS {STATEMENTS[name]}')
+            prepared.add(name)
+        if params:
+            cur.execute(f'EXECUTE repo_{name} ({", ".join(["%s"] * len(params))})', params)
+        else:
+            cur.execute(f'EXECUTE repo_{name}')
+        return cur
+
+    def _sumar_saldo(self, evento_id, usuario_id, monto):
+        ledger.add_purchase(self.cursor(), evento_id, usuario_id, monto)
+
+    def _restar_saldo(self, evento_id, usuario_id, monto):
+        ledger.remove_purchase(self.cursor(), evento_id, usuario_id, monto)
+
+
+SQLITE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id INTEGER PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        eliminado BOOLEAN NOT NULL DEFAULT false
+    );
+    CREATE TABLE IF NOT EXISTS eventos (
+        id INTEGER PRIMARY KEY,
+        nombre TEXT NOT NULL UNIQUE,
+        usuario_id INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE CASCADE,
+        eliminado BOOLEAN NOT NULL DEFAULT false
+    );
+    CREATE TABLE IF NOT EXISTS compras (
+        id INTEGER PRIMARY KEY,
+        evento_id INTEGER NOT NULL REFERENCES eventos(id) ON DELETE CASCADE,
+        comprador_id INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE CASCADE,
+        destinatario TEXT NOT NULL,
+        descripcion TEXT NOT NULL,
+        monto NUMERIC NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS compras_evento_comprador_idx ON compras (evento_id, comprador_id, id);
+    CREATE TABLE IF NOT EXISTS saldos (
+        evento_id INTEGER NOT NULL REFERENCES eventos(id) ON DELETE CASCADE,
+        usuario_id INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE CASCADE,
+        total NUMERIC NOT NULL DEFAULT 0,
+        num_compras INTEGER NOT NULL DEFAULT 0,
+        ultima_compra INTEGER,
+        PRIMARY KEY (evento_id, usuario_id)
+    );
+'''
+
+
+def _trigramas(texto):
+    # Como pg_trgm: palabras en minúsculas con dos espacios delante y uno detrás
+    trigramas = set()
+    for palabra in re.findall(r'\w+', texto.lower()):
+        palabra = f'  {palabra} '
+        trigramas.update(palabra[i:i + 3] for i in range(len(palabra) - 2))
+    return trigramas
+
+
+def _coincide_busqueda(texto, q, prefijo):
+    # Prefijo sin distinguir mayúsculas o similitud de trigramas >= 0.3 (umbral de pg_trgm)
+    if texto.lower().startswith(q.lower()):
+        return True
+    a, b = _trigramas(texto), _trigramas(q)
+    return bool(a and b) and len(a & b) / len(a | b) >= 0.3
+
+
+class SqliteRepository(Repository):
+    IntegrityError = sqlite3.IntegrityError
+    _SIN_LIMITE = -1
+
+    def __init__(self, path=':memory:'):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.executescript(SQLITE_SCHEMA)
+        conn.create_function('coincide_busqueda', 3, _coincide_busqueda, deterministic=True)
+        super().__init__(conn)
+
+    def _run(self, name, params):
+        return self.conn.execute(_PLACEHOLDER.sub(r'?\1', STATEMENTS[name]), params)
+
+    def _sumar_saldo(self, evento_id, usuario_id, monto):
+        self.conn.execute('''
+            INSERT INTO saldos (evento_id, usuario_id, total, num_compras, ultima_compra)
+            VALUES (?1, ?2, ?3, 1, (SELECT MAX(id) FROM compras WHERE evento_id = ?1 AND comprador_id = ?2))
+            ON CONFLICT (evento_id, usuario_id) DO UPDATE
+            SET total = saldos.total + excluded.total, num_compras = saldos.num_compras + 1,
+                ultima_compra = max(saldos.ultima_compra, excluded.ultima_compra)
+        ''', (evento_id, usuario_id, monto))
+
+    def _restar_saldo(self, evento_id, usuario_id, monto):
+        self.conn.execute('''
+            UPDATE saldos SET total = total - ?3, num_compras = num_compras - 1,
+                ultima_compra = (SELECT MAX(id) FROM compras WHERE evento_id = ?1 AND comprador_id = ?2)
+            WHERE evento_id = ?1 AND usuario_id = ?2
+        ''', (evento_id, usuario_id, monto))
+        self.conn.execute('DELETE FROM saldos WHERE evento_id = ? AND usuario_id = ? AND num_compras <= 0',
+                          (evento_id, usuario_id))
+
+
+def get_repository(readonly=False):
+    # Repositorio sobre la conexión de la petición (ver models.get_db_connection)
+    from models import get_db_connection
+    return PostgresRepository(get_db_connection(readonly=readonly))
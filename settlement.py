@@ -0,0 +1,33 @@
+# Liquidación de saldos: convierte {usuario: saldo} en una lista corta de
+# transferencias (quién paga a quién) que deja a todos cuadrados.
+# Voraz con dos montículos: el mayor deudor paga al mayor acreedor y el resto
+# vuelve al montículo. O(n log n) y como mucho n - 1 transferencias.
+import heapq
+
+
+def settle(saldos):
+    # saldos: {usuario: saldo} (positivo = le deben, negativo = debe).
+    # Se trabaja en céntimos para no acumular errores de coma flotante; los restos
+    # de redondeo menores de un céntimo por persona se ignoran.
+    acreedores = []
+    deudores = []
+    for usuario, saldo in saldos.items():
+        cents = round(saldo * 100)
+        if cents > 0:
+            acreedores.append((-cents, usuario))
+        elif cents < 0:
+            deudores.append((cents, usuario))
+    heapq.heapify(acreedores)
+    heapq.heapify(deudores)
+
+    transferencias = []
+    while acreedores and deudores:
+        credito, acreedor = heapq.heappop(acreedores)
+        deuda, deudor = heapq.heappop(deudores)
+        importe = min(-credito, -deuda)
+        transferencias.append({'de': deudor, 'para': acreedor, 'importe': importe / 100})
+        if -credito > importe:
+            heapq.heappush(acreedores, (credito + importe, acreedor))
+        if -deuda > importe:
+            heapq.heappush(deudores, (deuda + importe, deudor))
+    return transferencias
@@ -0,0 +1,142 @@
+import os
+import shutil
+
+import pytest
+
+PASSWORD = 'secreto'
+ADMIN_PASSWORD = 'salvatore777'
+
+# Los tests ejecutan la cola de trabajos a mano (jobs.run_pending). Antes de importar
+# los módulos de test: jobs lee la variable al importarse.
+os.environ.setdefault('JOBS_IN_PROCESS', '0')
+
+
+@pytest.fixture(scope='session')
+def pg_server(tmp_path_factory):
+    # Los tests borran el esquema: solo se usa TEST_DATABASE_URL, nunca DATABASE_URL.
+    # Sin ella se arranca un Postgres desechable con pgserver (requirements-dev.txt).
+    if os.environ.get('TEST_DATABASE_URL'):
+        yield None
+        return
+    pgserver = pytest.importorskip('pgserver', reason='define TEST_DATABASE_URL o instala pgserver')
+    server = pgserver.get_server(tmp_path_factory.mktemp('pgdata'), cleanup_mode='stop')
+    yield server
+    server.cleanup()
+
+
+@pytest.fixture(scope='session')
+def database_url(pg_server):
+    return os.environ.get('TEST_DATABASE_URL') or pg_server.get_uri()
+
+
+@pytest.fixture(scope='session')
+def replica_url(pg_server, tmp_path_factory):
+    # Réplica en streaming de la base de pruebas: TEST_REPLICA_DATABASE_URL o, con
+    # pgserver, una segunda instancia creada con pg_basebackup
+    url = os.environ.get('TEST_REPLICA_DATABASE_URL')
+    if url:
+        yield url
+        return
+    if pg_server is None:
+        pytest.skip('define TEST_REPLICA_DATABASE_URL para probar la réplica')
+    import pgserver
+    from pgserver import _commands
+
+    pgdata = tmp_path_factory.mktemp('pgreplica')
+    if pg_server.system_user:
+        shutil.chown(pgdata, pg_server.system_user, pg_server.system_user)
+    pgdata.chmod(0o700)
+    info = pg_server.get_postmaster_info()
+    _commands.pg_basebackup(
+        ['-h', str(info.socket_dir), '-p', str(info.port), '-U', 'postgres', '-D', str(pgdata), '-R', '-X', 'stream', '-c', 'fast'],
+        user=pg_server.system_user, timeout=60)
+    # La copia incluye el socket y el lock del primario (viven en su pgdata)
+    for path in pgdata.glob('.s.PGSQL.*'):
+        path.unlink()
+    server = pgserver.get_server(pgdata, cleanup_mode='stop')
+    yield server.get_uri()
+    server.cleanup()
+
+
+@pytest.fixture(scope='session')
+def app_module(database_url):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('DATABASE_SSLMODE', 'prefer')
+    os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+    # Conexiones SSE cortas para que los tests que leen el stream terminen pronto
+    os.environ.setdefault('SSE_MAX_SECONDS', '0.2')
+    import app as app_module
+    import models
+
+    conn = models.connect()
+    cur = conn.cursor()
+    cur.execute('DROP SCHEMA public CASCADE; CREATE SCHEMA public;')
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    app_module.app.config['TESTING'] = True
+    models.init_db()
+    app_module.create_admin_user()
+    return app_module
+
+
+def _seed(repo, hashed):
+    # Datos mínimos compartidos: cada test que borra algo usa sus propias filas
+    ids = {}
+    for username in ('ana', 'luis', 'eva', 'borrable'):
+        ids[username] = repo.crear_usuario(username, hashed)
+    for key, nombre in (('evento', 'Navidad'), ('evento_borrable', 'Borrable 1'), ('evento_borrable2', 'Borrable 2')):
+        ids[key] = repo.crear_evento(nombre, ids['eva'])
+    compras = [('ana', 'Zapatos', '40.00'), ('ana', 'Libro', '12.50'), ('ana', 'Bufanda', '9.99'), ('luis', 'Reloj', '55.00')]
+    for username, descripcion, monto in compras:
+        ids['compra_' + username] = repo.agregar_compra(ids['evento'], ids[username], username, descripcion, monto).id
+    repo.commit()
+    return ids
+
+
+@pytest.fixture(scope='session')
+def seed(app_module):
+    import models
+    from repository import PostgresRepository
+
+    repo = PostgresRepository(models.connect())
+    ids = _seed(repo, app_module.bcrypt.generate_password_hash(PASSWORD).decode('utf-8'))
+    repo.conn.close()
+    return ids
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def repo(request):
+    # Repositorio con los datos de seed en cada backend. SQLite no necesita servidor;
+    # en Postgres lo que escriba el test se deshace al terminar.
+    from repository import PostgresRepository, SqliteRepository
+
+    if request.param == 'sqlite':
+        repo = SqliteRepository()
+        repo.crear_usuario('admin', 'x')
+        repo.ids = _seed(repo, 'x')
+        yield repo
+        repo.conn.close()
+        return
+    ids = request.getfixturevalue('seed')
+    import models
+
+    repo = PostgresRepository(models.connect())
+    repo.ids = ids
+    yield repo
+    repo.rollback()
+    repo.conn.close()
+
+
+@pytest.fixture
+def login(app_module, seed):
+    # Devuelve un cliente autenticado con la caché de usuarios ya caliente
+    def _login(username):
+        client = app_module.app.test_client()
+        if username:
+            password = ADMIN_PASSWORD if username == 'admin' else PASSWORD
+            client.post('/login', data={'username': username, 'password': password})
+            client.get('/metrics')
+        return client
+    return _login
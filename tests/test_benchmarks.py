@@ -0,0 +1,76 @@
+# Datos de benchmark reproducibles, percentiles y comparación con baselines, y una
+# pasada corta del benchmark de carga en una base de datos aparte
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import models
+from benchmarks import dataset, load
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert load.percentile(values, 50) == 50
+    assert load.percentile(values, 95) == 95
+    assert load.percentile(values, 99) == 99
+    assert load.percentile([7], 99) == 7
+    assert load.percentile([], 50) is None
+
+
+def test_compare_flags_regressions():
+    base = {'rutas': {'cuentas': {'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0, 'rps': 100.0}}}
+    actual = {'rutas': {
+        'cuentas': {'p50_ms': 10.5, 'p95_ms': 25.0, 'p99_ms': 30.0, 'rps': 80.0},
+        'dashboard': {'p50_ms': 1.0, 'p95_ms': 2.0, 'p99_ms': 3.0, 'rps': 500.0},
+    }}
+    filas = {(ruta, metrica): regresion for ruta, metrica, _, _, _, regresion in load.compare(base, actual, 0.10)}
+    assert filas == {('cuentas', 'p50_ms'): False, ('cuentas', 'p95_ms'): True,
+                     ('cuentas', 'p99_ms'): False, ('cuentas', 'rps'): True}
+
+
+@pytest.fixture
+def bench_db(app_module, database_url, monkeypatch):
+    # Base de datos propia: el dataset borra el esquema y no debe tocar la de los tests.
+    # Las cachés de la app se vacían porque los ids de ambas bases coinciden.
+    admin = psycopg2.connect(database_url)
+    admin.autocommit = True
+    admin.cursor().execute('DROP DATABASE IF EXISTS benchmarks')
+    admin.cursor().execute('CREATE DATABASE benchmarks')
+    admin.close()
+    monkeypatch.setenv('DATABASE_URL', psycopg2.extensions.make_dsn(database_url, dbname='benchmarks'))
+    app_module.user_cache.clear()
+    app_module.page_cache.clear()
+    yield
+    models.get_pool().closeall()
+    app_module.user_cache.clear()
+    app_module.page_cache.clear()
+
+
+def _snapshot():
+    conn = models.connect()
+    cur = conn.cursor()
+    cur.execute('SELECT evento_id, comprador_id, descripcion, monto FROM compras ORDER BY id')
+    compras = cur.fetchall()
+    cur.execute('SELECT evento_id, usuario_id, total, num_compras FROM saldos ORDER BY 1, 2')
+    saldos = cur.fetchall()
+    conn.close()
+    return compras, saldos
+
+
+def test_dataset_is_reproducible_and_load_runs(bench_db):
+    dataset.seed(usuarios=12, eventos=3, compras=300, reset=True)
+    compras, saldos = _snapshot()
+    assert len(compras) == 300
+    assert sum(s[3] for s in saldos) == 300
+    with pytest.raises(SystemExit):
+        dataset.seed(usuarios=12, eventos=3, compras=300)
+
+    dataset.seed(usuarios=12, eventos=3, compras=300, reset=True)
+    assert _snapshot() == (compras, saldos)
+
+    resultado = load.run('client', ['ver_evento', 'cuentas', 'cuenta_total'], sesiones=2, peticiones=5)
+    assert resultado['datos'] == {'usuarios': 13, 'eventos': 3, 'compras': 300}
+    for r in resultado['rutas'].values():
+        assert r['peticiones'] == 10
+        assert r['errores'] == 0
+        assert 0 < r['p50_ms'] <= r['p95_ms'] <= r['p99_ms']
@@ -0,0 +1,95 @@
+# HTML comprimido al vuelo por encima del umbral, static/ con huella y caché
+# immutable, ficheros precomprimidos y bytes ahorrados por endpoint
+import gzip
+import re
+
+import brotli
+import pytest
+
+import assets
+import compression
+
+
+@pytest.fixture
+def small_threshold(monkeypatch):
+    monkeypatch.setattr(compression, 'COMPRESS_MIN_BYTES', 200)
+
+
+def test_html_is_gzipped_when_accepted(app_module, seed, login, small_threshold):
+    client = login('ana')
+    plano = client.get(f"/cuentas/{seed['evento']}")
+    assert 'Content-Encoding' not in plano.headers
+    assert 'Accept-Encoding' in plano.headers['Vary']
+
+    antes = compression.SAVED_BYTES.value('cuentas', 'gzip')
+    response = client.get(f"/cuentas/{seed['evento']}", headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plano.data
+    assert int(response.headers['Content-Length']) == len(response.data) < len(plano.data)
+    assert compression.SAVED_BYTES.value('cuentas', 'gzip') == antes + len(plano.data) - len(response.data)
+
+    # ETag débil: el navegador revalida con él y sigue obteniendo 304
+    etag = response.headers['ETag']
+    assert etag.startswith('W/') and etag[2:] == plano.headers['ETag']
+    revalidada = client.get(f"/cuentas/{seed['evento']}", headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert revalidada.status_code == 304
+
+
+def test_brotli_is_preferred_when_accepted(app_module, seed, login, small_threshold):
+    client = login('ana')
+    plano = client.get('/').data
+    response = client.get('/', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == plano
+
+
+def test_small_and_streamed_responses_are_not_compressed(app_module, seed, login):
+    client = login('ana')
+    response = client.get('/login', headers={'Accept-Encoding': 'gzip'})
+    assert len(response.data) < compression.COMPRESS_MIN_BYTES
+    assert 'Content-Encoding' not in response.headers
+    export = client.get(f"/evento/{seed['evento']}/exportar/csv", headers={'Accept-Encoding': 'gzip'})
+    assert export.get_data().startswith(b'id,')
+    assert 'Content-Encoding' not in export.headers
+
+
+def test_static_urls_are_fingerprinted_and_immutable(app_module, login):
+    html = login(None).get('/login').get_data(as_text=True)
+    url = re.search(r'/static/style\.([0-9a-f]{12})\.css', html).group(0)
+    response = login(None).get(url)
+    assert response.status_code == 200
+    assert response.cache_control.immutable and response.cache_control.max_age == assets.STATIC_MAX_AGE
+
+    # Sin huella o con una huella que ya no corresponde: se sirve, pero sin caché larga
+    for path in ('/static/style.css', '/static/style.000000000000.css'):
+        response = login(None).get(path)
+        assert response.status_code == 200
+        assert not response.cache_control.immutable and not response.cache_control.max_age
+    assert login(None).get('/static/nada.000000000000.css').status_code == 404
+
+
+def test_precompressed_static_files(app_module, tmp_path, monkeypatch):
+    css = ('body { margin: 0; padding: 0; }\n' * 200).encode()
+    (tmp_path / 'app.css').write_bytes(css)
+    (tmp_path / 'vacio.css').write_bytes(b'')
+    monkeypatch.setattr(app_module.app, 'static_folder', str(tmp_path))
+    monkeypatch.setattr(assets, '_hashes', assets.fingerprints(str(tmp_path)))
+
+    escritos = assets.precompress(str(tmp_path))
+    assert {(f, e) for f, e, _, _ in escritos} == {('app.css', e) for e in compression.available_encodings()}
+    assert not (tmp_path / 'vacio.css.gz').exists()
+
+    client = app_module.app.test_client()
+    with app_module.app.test_request_context():
+        url = app_module.url_for('static', filename='app.css')
+    antes = compression.SAVED_BYTES.value('static', 'gzip')
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.cache_control.immutable
+    assert gzip.decompress(response.data) == css
+    assert compression.SAVED_BYTES.value('static', 'gzip') == antes + len(css) - len(response.data)
+
+    plano = client.get(url)
+    assert 'Content-Encoding' not in plano.headers and plano.data == css
@@ -0,0 +1,52 @@
+import metrics
+
+
+def _revalidate(client, path, response):
+    return client.get(path, headers={'If-None-Match': response.headers['ETag']})
+
+
+def test_unchanged_event_page_answers_304_with_one_query(login, seed):
+    client = login('ana')
+    path = f"/evento/{seed['evento']}"
+    first = client.get(path)
+    assert first.status_code == 200
+    assert first.headers['ETag']
+    assert first.headers['Last-Modified']
+    assert 'private' in first.headers['Cache-Control']
+
+    before = metrics.REQUEST_QUERIES.snapshot('ver_evento')
+    second = _revalidate(client, path, first)
+    after = metrics.REQUEST_QUERIES.snapshot('ver_evento')
+    assert second.status_code == 304
+    assert second.get_data() == b''
+    assert after[0] - before[0] == 1
+
+
+def test_purchase_changes_event_and_total_etags(login, seed):
+    ana = login('ana')
+    admin = login('admin')
+    evento = f"/evento/{seed['evento']}"
+    cuentas = f"/cuentas/{seed['evento']}"
+    pages = {path: ana.get(path) for path in (evento, cuentas)}
+    total = admin.get('/cuenta-total')
+
+    ana.post('/compra', data={'evento_id': seed['evento'], 'descripcion': 'Vela', 'monto': '1.00'})
+    ana.get(f"/mis-compras/{seed['evento']}")  # consume el flash
+
+    for path, response in pages.items():
+        assert _revalidate(ana, path, response).status_code == 200
+    assert _revalidate(admin, '/cuenta-total', total).status_code == 200
+
+
+def test_etag_is_per_user(login, seed):
+    path = f"/cuentas/{seed['evento']}"
+    ana = login('ana').get(path)
+    luis = login('luis').get(path)
+    assert ana.headers['ETag'] != luis.headers['ETag']
+
+
+def test_new_user_changes_dashboard_etag(login):
+    admin = login('admin')
+    first = admin.get('/')
+    admin.post('/admin/create-user', data={'username': 'primo', 'password': 'x'})
+    assert _revalidate(admin, '/', first).status_code == 200
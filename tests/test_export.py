@@ -0,0 +1,46 @@
+# Exportación en streaming: la cabecera sale antes de la consulta y la primera fila
+# en cuanto llega, sin esperar a llenar un trozo
+import json
+
+import export
+import models
+
+
+def _rows(consumidas, n=3):
+    for i in range(n):
+        consumidas.append(i)
+        yield (i, f'compra {i}')
+
+
+def test_csv_sends_header_and_first_row_at_once():
+    consumidas = []
+    trozos = export.to_csv(['id', 'descripcion'], _rows(consumidas))
+    assert next(trozos) == 'id,descripcion\r\n'
+    assert consumidas == []
+    assert next(trozos) == '0,compra 0\r\n'
+    assert consumidas == [0]
+    assert ''.join(trozos) == '1,compra 1\r\n2,compra 2\r\n'
+
+
+def test_json_sends_first_item_at_once():
+    consumidas = []
+    trozos = export.to_json(['id', 'descripcion'], _rows(consumidas))
+    assert next(trozos) == '[' and consumidas == []
+    primero = next(trozos)
+    assert consumidas == [0]
+    assert json.loads('[' + primero + ''.join(trozos)) == [{'id': i, 'descripcion': f'compra {i}'} for i in range(3)]
+    assert json.loads(''.join(export.to_json(['id'], iter(())))) == []
+
+
+def test_event_export_reads_purchases_in_index_order(app_module, seed):
+    conn = models.connect()
+    cur = conn.cursor()
+    # Con tan pocas filas el planificador prefiere recorrer la tabla: se le obliga a usar
+    # índices y se comprueba que alguno da ya el orden (sin Sort)
+    cur.execute('SET LOCAL enable_seqscan = off')
+    cur.execute('SET LOCAL enable_bitmapscan = off')
+    cur.execute('EXPLAIN SELECT id FROM compras WHERE evento_id = %s ORDER BY id', (seed['evento'],))
+    plan = '\n'.join(fila[0] for fila in cur.fetchall())
+    conn.rollback()
+    conn.close()
+    assert 'compras_evento_id_idx' in plan and 'Sort' not in plan, plan
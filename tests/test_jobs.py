@@ -0,0 +1,226 @@
+# Borrados en segundo plano: la ruta oculta y encola, el worker borra por lotes con
+# los saldos al día, los workers no se pisan (SKIP LOCKED) y los fallos se reintentan
+import queue
+import select
+
+import pytest
+
+import jobs
+import ledger
+import models
+from conftest import PASSWORD
+from repository import PostgresRepository
+
+
+@pytest.fixture
+def conn(app_module):
+    conn = models.connect()
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+@pytest.fixture
+def evento_grande(app_module, seed):
+    # Evento propio con compras de varios usuarios (los tests lo borran)
+    repo = PostgresRepository(models.connect())
+    evento_id = repo.crear_evento(f'Grande {id(repo)}', seed['eva'])
+    for i in range(7):
+        comprador = seed['ana'] if i % 2 else seed['luis']
+        repo.agregar_compra(evento_id, comprador, 'eva', f'Regalo {i}', '1.50')
+    repo.commit()
+    repo.conn.close()
+    return evento_id
+
+
+def _count(conn, sql, *params):
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    value = cur.fetchone()[0]
+    conn.rollback()
+    return value
+
+
+def _job(conn, job_id):
+    cur = conn.cursor()
+    cur.execute('SELECT estado, intentos, procesadas, error FROM trabajos WHERE id = %s', (job_id,))
+    row = cur.fetchone()
+    conn.rollback()
+    return row
+
+
+def _last_job(conn):
+    return _count(conn, 'SELECT max(id) FROM trabajos')
+
+
+def test_event_is_hidden_at_once_and_deleted_in_batches(conn, evento_grande, login, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOBS_BATCH_SIZE', 3)
+    admin, ana = login('admin'), login('ana')
+    response = admin.post(f'/eliminar-evento/{evento_grande}', follow_redirects=True)
+    job_id = _last_job(conn)
+    assert f'trabajo #{job_id}' in response.get_data(as_text=True)
+
+    # Oculto para todos, pero las compras siguen ahí hasta que corra el trabajo
+    assert 'Grande' not in ana.get('/').get_data(as_text=True)
+    assert ana.get(f'/evento/{evento_grande}').status_code == 302
+    assert _count(conn, 'SELECT count(*) FROM compras WHERE evento_id = %s', evento_grande) == 7
+    assert _job(conn, job_id)[0] == 'pendiente'
+
+    assert jobs.run_pending(conn) >= 1
+    assert _job(conn, job_id) == ('hecho', 1, 7, None)
+    assert _count(conn, 'SELECT count(*) FROM eventos WHERE id = %s', evento_grande) == 0
+    assert _count(conn, 'SELECT count(*) FROM saldos WHERE evento_id = %s', evento_grande) == 0
+    assert ledger.verify(conn) == []
+
+    html = admin.get('/admin/trabajos').get_data(as_text=True)
+    assert 'eliminar_evento' in html and 'hecho' in html
+
+
+def test_hidden_event_stops_counting_at_once(conn, evento_grande, login):
+    admin, luis = login('admin'), login('luis')
+
+    def aportado():
+        saldos = admin.get('/cuenta-total/transferencias').get_json()['saldos']
+        return round(saldos['luis']['aportado'], 2)
+
+    antes = aportado()
+    admin.post(f'/eliminar-evento/{evento_grande}')
+    # Las compras siguen en la tabla, pero ya no cuentan en ningún total
+    assert _count(conn, 'SELECT count(*) FROM compras WHERE evento_id = %s', evento_grande) == 7
+    assert aportado() == round(antes - 6.00, 2)
+    csv = admin.get('/cuenta-total/exportar/csv').get_data(as_text=True)
+    assert f"luis,{antes - 6.00:.2f}" in csv
+
+    response = luis.post('/compra', data={'evento_id': evento_grande, 'descripcion': 'Tarde', 'monto': '1.00'},
+                         follow_redirects=True)
+    assert 'Evento no encontrado' in response.get_data(as_text=True)
+    assert _count(conn, 'SELECT count(*) FROM compras WHERE evento_id = %s', evento_grande) == 7
+    jobs.run_pending(conn)
+
+
+def test_deleting_again_does_not_enqueue_twice(conn, evento_grande, login):
+    admin = login('admin')
+    admin.post('/crear-evento', data={'eliminar_evento': evento_grande})
+    job_id = _last_job(conn)
+    response = admin.post(f'/eliminar-evento/{evento_grande}', follow_redirects=True)
+    assert 'Evento no encontrado' in response.get_data(as_text=True)
+    assert _last_job(conn) == job_id
+    jobs.run_pending(conn)
+
+
+def test_user_deletion_removes_purchases_and_own_events(conn, app_module, login):
+    repo = PostgresRepository(models.connect())
+    hashed = app_module.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    usuario_id = repo.crear_usuario('efimero', hashed)
+    otro = repo.crear_usuario('efimero2', hashed)
+    propio = repo.crear_evento('Evento de efimero', usuario_id)
+    ajeno = repo.crear_evento('Evento de efimero2', otro)
+    repo.agregar_compra(propio, otro, 'efimero', 'Taza', '3.00')
+    repo.agregar_compra(ajeno, usuario_id, 'efimero2', 'Vela', '2.00')
+    repo.agregar_compra(ajeno, usuario_id, 'efimero2', 'Libro', '8.00')
+    repo.commit()
+    repo.conn.close()
+
+    sesion = login('efimero')
+    admin = login('admin')
+
+    def aportado_efimero2():
+        return admin.get('/cuenta-total/transferencias').get_json()['saldos']['efimero2']['aportado']
+
+    assert aportado_efimero2() == 3.00
+    admin.post(f'/admin/delete-user/{usuario_id}')
+    # Su evento deja de contar al momento, aunque las compras sigan ahí hasta el trabajo
+    assert aportado_efimero2() == 0
+    assert 'efimero2,0.00' in admin.get('/cuenta-total/exportar/csv').get_data(as_text=True)
+    job_id = _last_job(conn)
+    # La sesión abierta deja de valer y ya no puede volver a entrar
+    assert sesion.get('/').status_code == 302
+    assert login('efimero').get('/').status_code == 302
+    assert 'efimero2' in admin.get('/admin/create-user?q=efimero').get_data(as_text=True)
+    assert '>efimero<' not in admin.get('/admin/create-user?q=efimero').get_data(as_text=True)
+
+    jobs.run_pending(conn)
+    assert _job(conn, job_id) == ('hecho', 1, 3, None)
+    assert _count(conn, 'SELECT count(*) FROM usuarios WHERE id = %s', usuario_id) == 0
+    assert _count(conn, 'SELECT count(*) FROM eventos WHERE id = %s', propio) == 0
+    assert _count(conn, 'SELECT count(*) FROM compras WHERE evento_id = %s', ajeno) == 0
+    assert ledger.verify(conn) == []
+
+
+def test_workers_skip_locked_jobs(conn, app_module):
+    cur = conn.cursor()
+    primero = jobs.enqueue(cur, 'eliminar_evento', 10 ** 6)
+    segundo = jobs.enqueue(cur, 'eliminar_evento', 10 ** 6 + 1)
+    conn.commit()
+    # Otro worker tiene bloqueado el primero: este se lleva el segundo sin esperar
+    otro = models.connect()
+    otro.cursor().execute('SELECT id FROM trabajos WHERE id = %s FOR UPDATE', (primero,))
+    assert jobs.claim(conn)[0] == segundo
+    otro.rollback()
+    otro.close()
+    assert jobs.claim(conn)[0] == primero
+    cur.execute("UPDATE trabajos SET estado = 'hecho' WHERE id IN (%s, %s)", (primero, segundo))
+    conn.commit()
+
+
+def test_failed_job_is_retried_then_marked_as_error(conn, app_module, monkeypatch):
+    def falla(conn, job_id, objetivo):
+        raise RuntimeError('sin disco')
+
+    monkeypatch.setitem(jobs.HANDLERS, 'eliminar_evento', falla)
+    monkeypatch.setattr(jobs, 'JOBS_MAX_ATTEMPTS', 2)
+    job_id = jobs.enqueue(conn.cursor(), 'eliminar_evento', 10 ** 6)
+    conn.commit()
+    assert jobs.run_one(conn)
+    assert _job(conn, job_id) == ('pendiente', 1, 0, 'RuntimeError: sin disco')
+    assert jobs.run_one(conn)
+    assert _job(conn, job_id)[:2] == ('error', 2)
+    assert not jobs.run_one(conn)
+
+
+def test_abandoned_job_is_retried_until_the_attempt_limit(conn, app_module, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOBS_MAX_ATTEMPTS', 2)
+    job_id = jobs.enqueue(conn.cursor(), 'eliminar_evento', 10 ** 6)
+    conn.commit()
+
+    def abandonar():
+        # Como si el proceso hubiera muerto a mitad del trabajo
+        conn.cursor().execute("UPDATE trabajos SET actualizado = now() - interval '1 hour' WHERE id = %s", (job_id,))
+        conn.commit()
+
+    assert jobs.claim(conn)[0] == job_id
+    abandonar()
+    assert jobs.claim(conn)[0] == job_id
+    abandonar()
+    assert jobs.claim(conn) is None
+    estado, intentos, _, error = _job(conn, job_id)
+    assert (estado, intentos) == ('error', 2) and 'Abandonado' in error
+
+
+def test_enqueue_notifies_workers_on_commit(conn, app_module):
+    listen = models.connect()
+    listen.autocommit = True
+    listen.cursor().execute(f'LISTEN {jobs.CHANNEL}')
+    job_id = jobs.enqueue(conn.cursor(), 'eliminar_evento', 10 ** 6)
+    conn.commit()
+    assert select.select([listen], [], [], 5) != ([], [], [])
+    listen.poll()
+    assert [n.payload for n in listen.notifies] == [str(job_id)]
+    listen.close()
+    conn.cursor().execute("UPDATE trabajos SET estado = 'hecho' WHERE id = %s", (job_id,))
+    conn.commit()
+
+
+def test_web_worker_is_woken_through_the_shared_listen_connection(conn, app_module):
+    # En un proceso web los avisos llegan por la conexión LISTEN de live.py
+    import live
+
+    avisos = queue.Queue()
+    broadcaster = live.Broadcaster(models.connect, handlers={jobs.CHANNEL: avisos.put})
+    broadcaster.ensure_started()
+    assert broadcaster._ready.wait(5)
+    job_id = jobs.enqueue(conn.cursor(), 'eliminar_evento', 10 ** 6)
+    conn.commit()
+    assert avisos.get(timeout=5) == str(job_id)
+    conn.cursor().execute("UPDATE trabajos SET estado = 'hecho' WHERE id = %s", (job_id,))
+    conn.commit()
@@ -0,0 +1,66 @@
+# Listados de eventos y usuarios: paginación keyset por nombre y búsqueda por
+# prefijo o aproximada, iguales en Postgres (pg_trgm) y SQLite
+import pytest
+
+from repository import PostgresRepository
+
+
+def test_pages_cover_every_event_once(repo):
+    todos, _ = repo.pagina_eventos(limite=1000)
+    vistos, despues = [], None
+    while True:
+        eventos, despues = repo.pagina_eventos(despues=despues, limite=2)
+        assert len(eventos) <= 2
+        vistos += [e.nombre for e in eventos]
+        if despues is None:
+            break
+    assert vistos == [e.nombre for e in todos]
+    assert 'Navidad' in vistos
+
+
+def test_search_by_prefix_and_fuzzy(repo):
+    eventos, _ = repo.pagina_eventos('nav')
+    assert [e.nombre for e in eventos] == ['Navidad']
+    # Los comodines de LIKE se buscan literalmente
+    eventos, _ = repo.pagina_eventos('%')
+    assert eventos == []
+    usuarios, _ = repo.pagina_usuarios('LU')
+    assert [u.username for u in usuarios] == ['luis']
+
+
+def test_fuzzy_search(repo):
+    # Con una errata: coincidencia aproximada por trigramas (si Postgres tiene pg_trgm)
+    if isinstance(repo, PostgresRepository):
+        cur = repo.conn.cursor()
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if not cur.fetchone():
+            pytest.skip('Postgres sin pg_trgm')
+    eventos, _ = repo.pagina_eventos('Navidat')
+    assert [e.nombre for e in eventos] == ['Navidad']
+
+
+def test_generic_plans_use_the_name_index(repo):
+    # Tras 5 EXECUTE Postgres puede quedarse con el plan genérico: la página siguiente
+    # tiene que seguir siendo un rango del índice, no un recorrido entero
+    if not isinstance(repo, PostgresRepository):
+        pytest.skip('solo Postgres')
+    repo.pagina_usuarios(despues='luis')
+    repo.pagina_eventos(despues='Navidad', excluir_usuario=repo.ids['ana'])
+    cur = repo.conn.cursor()
+    cur.execute('SET LOCAL plan_cache_mode = force_generic_plan')
+    cur.execute('SET LOCAL enable_seqscan = off')
+    for sentencia in ("repo_pagina_usuarios ('luis', 51)", f"repo_pagina_eventos ({repo.ids['ana']}, 'Navidad', 51)"):
+        cur.execute(f'EXPLAIN EXECUTE {sentencia}')
+        plan = '\n'.join(fila[0] for fila in cur.fetchall())
+        assert 'Index Cond' in plan and '> $' in plan, plan
+
+
+def test_dashboard_excludes_own_events(repo):
+    eventos, _ = repo.pagina_eventos('Navidad', excluir_usuario=repo.ids['eva'])
+    assert eventos == []
+
+
+def test_dashboard_search_page(login):
+    html = login('ana').get('/?q=navid').get_data(as_text=True)
+    assert 'Navidad' in html
+    assert 'Borrable' not in html
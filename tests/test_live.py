@@ -0,0 +1,49 @@
+# Las compras nuevas y borradas llegan por NOTIFY a los suscritos del evento
+import json
+
+
+def test_purchase_notifies_subscribers(app_module, seed, login):
+    broadcaster = app_module.broadcaster
+    suscripcion = broadcaster.subscribe(seed['evento'])
+    otro = broadcaster.subscribe(seed['evento_borrable2'])
+    try:
+        # subscribe() vuelve con LISTEN ya activo: el primer aviso no se pierde
+        login('luis').post('/compra', data={'evento_id': seed['evento'], 'descripcion': 'Vela', 'monto': '2.50'})
+        nueva = json.loads(suscripcion.get(timeout=5))
+        assert nueva['tipo'] == 'nueva'
+        assert nueva['evento_id'] == seed['evento']
+        assert nueva['comprador'] == 'luis'
+        assert nueva['compra']['descripcion'] == 'Vela'
+        assert nueva['total_evento'] >= nueva['total_comprador'] > 0
+
+        assert suscripcion.empty()
+        login('luis').post(f"/eliminar-compra/{nueva['compra']['id']}/{seed['evento']}")
+        eliminada = json.loads(suscripcion.get(timeout=5))
+        assert eliminada['tipo'] == 'eliminada'
+        assert eliminada['compra']['id'] == nueva['compra']['id']
+        assert round(nueva['total_comprador'] - eliminada['total_comprador'], 2) == 2.5
+        assert otro.empty()
+    finally:
+        broadcaster.unsubscribe(seed['evento'], suscripcion)
+        broadcaster.unsubscribe(seed['evento_borrable2'], otro)
+
+
+def test_stream_sends_events(app_module, seed, login):
+    response = login('ana').get(f"/evento/{seed['evento']}/stream")
+    assert response.mimetype == 'text/event-stream'
+    assert response.get_data(as_text=True).startswith('retry: ')
+    assert app_module.broadcaster.subscriber_count() == 0
+
+
+def test_streams_over_the_limit_get_503(app_module, seed, login, monkeypatch):
+    monkeypatch.setattr(app_module.live, 'SSE_MAX_STREAMS', 1)
+    broadcaster = app_module.broadcaster
+    abierta = broadcaster.subscribe(seed['evento'])
+    try:
+        response = login('ana').get(f"/evento/{seed['evento']}/stream")
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == str(app_module.live.SSE_BUSY_RETRY_SECONDS)
+        assert broadcaster.subscriber_count() == 1
+    finally:
+        broadcaster.unsubscribe(seed['evento'], abierta)
+    assert login('ana').get(f"/evento/{seed['evento']}/stream").status_code == 200
@@ -0,0 +1,68 @@
+import metrics
+from cache import PageCache, page_cache
+
+
+def test_lru_is_bounded_by_size():
+    cache = PageCache(max_bytes=10)
+    cache.set('compras.', 'a', '12345')
+    cache.set('compras.', 'b', '12345')
+    cache.get('compras.', 'a')
+    cache.set('compras.', 'c', '12345')
+    assert cache.get('compras.', 'a') == '12345'
+    assert cache.get('compras.', 'b') is None
+    assert cache.stats()['bytes'] == 10
+
+
+def test_shared_directory_is_seen_by_other_workers(tmp_path):
+    worker1 = PageCache(directory=str(tmp_path))
+    worker2 = PageCache(directory=str(tmp_path))
+    worker1.set('evento-1.', 'k', '<html>')
+    assert worker2.get('evento-1.', 'k') == '<html>'
+    assert worker2.stats()['shared_hits'] == 1
+    worker1.invalidate('evento-1.')
+    assert PageCache(directory=str(tmp_path)).get('evento-1.', 'k') is None
+
+
+def test_shared_directory_is_bounded_by_size(tmp_path):
+    cache = PageCache(directory=str(tmp_path), directory_max_bytes=1000)
+    for i in range(50):
+        cache.set('catalogo.', f'k{i}', 'x' * 100)
+    assert sum(f.stat().st_size for f in tmp_path.iterdir()) <= 1000
+    assert PageCache(directory=str(tmp_path)).get('catalogo.', 'k49') == 'x' * 100
+
+
+def test_searches_are_not_cached(login, seed):
+    client = login('ana')
+    client.get('/')
+    entries = page_cache.stats()['entries']
+    for q in ('a', 'b', 'c'):
+        client.get('/', query_string={'q': q})
+    assert page_cache.stats()['entries'] == entries
+
+
+def test_invalidate_matches_whole_event_scope():
+    cache = PageCache()
+    cache.set('evento-1.', 'k', 'uno')
+    cache.set('evento-12.', 'k', 'doce')
+    cache.invalidate('evento-1.')
+    assert cache.get('evento-1.', 'k') is None
+    assert cache.get('evento-12.', 'k') == 'doce'
+
+
+def test_cached_page_skips_queries_until_a_purchase(login, seed):
+    client = login('luis')
+    path = f"/cuentas/{seed['evento']}"
+    first = client.get(path)
+    hits = page_cache.stats()['hits']
+
+    before = metrics.REQUEST_QUERIES.snapshot('cuentas')
+    second = client.get(path)
+    after = metrics.REQUEST_QUERIES.snapshot('cuentas')
+    assert second.get_data() == first.get_data()
+    assert page_cache.stats()['hits'] == hits + 1
+    assert after[0] - before[0] == 1
+
+    client.post('/compra', data={'evento_id': seed['evento'], 'descripcion': 'Pila', 'monto': '2.00'})
+    client.get(f"/mis-compras/{seed['evento']}")  # consume el flash
+    third = client.get(path)
+    assert third.get_data() != first.get_data()
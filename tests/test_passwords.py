@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+import models
+from passwords import PasswordHasher, PasswordPoolBusy, hash_cost
+
+
+class _SlowBcrypt:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def check_password_hash(self, password_hash, password):
+        self.release.wait(5)
+        return True
+
+
+def test_saturated_pool_rejects_immediately():
+    slow = _SlowBcrypt()
+    hasher = PasswordHasher(slow, 4, workers=1, max_pending=0)
+    worker = threading.Thread(target=hasher.verify, args=('h', 'p'))
+    worker.start()
+    try:
+        with pytest.raises(PasswordPoolBusy):
+            hasher.verify('h', 'p')
+    finally:
+        slow.release.set()
+        worker.join()
+    assert hasher.verify('h', 'p') is True
+
+
+def test_login_rehashes_when_cost_policy_changes(app_module, seed):
+    old_hash = app_module.bcrypt.generate_password_hash('antigua', 5).decode('utf-8')
+    conn = models.connect()
+    cur = conn.cursor()
+    cur.execute('INSERT INTO usuarios (username, password_hash) VALUES (%s, %s) RETURNING id', ('rehash', old_hash))
+    user_id = cur.fetchone()[0]
+    conn.commit()
+
+    response = app_module.app.test_client().post('/login', data={'username': 'rehash', 'password': 'antigua'})
+    assert response.status_code == 302
+
+    cur.execute('SELECT password_hash FROM usuarios WHERE id = %s', (user_id,))
+    new_hash = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    assert new_hash != old_hash
+    assert hash_cost(new_hash) == app_module.passwords.log_rounds
+    assert app_module.bcrypt.check_password_hash(new_hash, 'antigua')
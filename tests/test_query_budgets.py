@@ -0,0 +1,92 @@
+# Cada ruta declara con @metrics.query_budget(n) cuántas consultas SQL puede ejecutar.
+# Estos tests ejecutan todas las rutas y fallan si alguna supera su presupuesto.
+import io
+
+import pytest
+
+import metrics
+from conftest import PASSWORD
+
+# (id, usuario, método, ruta, datos del formulario)
+CASES = [
+    ('login_form', None, 'GET', '/login', None),
+    ('login', None, 'POST', '/login', {'username': 'ana', 'password': PASSWORD}),
+    ('logout', 'ana', 'GET', '/logout', None),
+    ('register', None, 'GET', '/register', None),
+    ('dashboard', 'ana', 'GET', '/', None),
+    ('dashboard_busqueda', 'ana', 'GET', '/?q=navid&despues=A', None),
+    ('mis_compras', 'ana', 'GET', '/mis-compras/{evento}', None),
+    ('ver_evento', 'ana', 'GET', '/evento/{evento}', None),
+    ('ver_evento_pagina', 'ana', 'GET', '/evento/{evento}?antes={compra_ana}', None),
+    ('exportar_compras', 'ana', 'GET', '/evento/{evento}/exportar/csv', None),
+    ('stream_evento', 'ana', 'GET', '/evento/{evento}/stream', None),
+    ('cuentas', 'ana', 'GET', '/cuentas/{evento}', None),
+    ('transferencias_evento', 'ana', 'GET', '/cuentas/{evento}/transferencias', None),
+    ('agregar_compra', 'luis', 'POST', '/compra', {'evento_id': '{evento}', 'descripcion': 'Pañuelo', 'monto': '3.20'}),
+    ('eliminar_compra', 'luis', 'POST', '/eliminar-compra/{compra_luis}/{evento}', None),
+    ('cuenta_total', 'admin', 'GET', '/cuenta-total', None),
+    ('transferencias_cuenta_total', 'admin', 'GET', '/cuenta-total/transferencias', None),
+    ('exportar_cuenta_total', 'admin', 'GET', '/cuenta-total/exportar/json', None),
+    ('metrics', 'admin', 'GET', '/metrics', None),
+    ('admin_create_user_form', 'admin', 'GET', '/admin/create-user', None),
+    ('admin_create_user_busqueda', 'admin', 'GET', '/admin/create-user?q=lu', None),
+    ('admin_create_user', 'admin', 'POST', '/admin/create-user', {'username': 'nuevo', 'password': PASSWORD}),
+    ('admin_delete_user', 'admin', 'POST', '/admin/delete-user/{borrable}', None),
+    ('admin_trabajos', 'admin', 'GET', '/admin/trabajos', None),
+    ('crear_evento_form', 'admin', 'GET', '/crear-evento', None),
+    ('crear_evento_busqueda', 'admin', 'GET', '/crear-evento?q=borr&uq=an&udespues=a', None),
+    ('crear_evento_duplicado', 'admin', 'POST', '/crear-evento', {'nombre': 'Navidad', 'usuario_id': '{eva}'}),
+    ('crear_evento', 'admin', 'POST', '/crear-evento', {'nombre': 'Reyes', 'usuario_id': '{eva}'}),
+    ('crear_evento_eliminar', 'admin', 'POST', '/crear-evento', {'eliminar_evento': '{evento_borrable}'}),
+    ('eliminar_evento', 'admin', 'POST', '/eliminar-evento/{evento_borrable2}', None),
+    ('importar_compras_form', 'admin', 'GET', '/admin/importar-compras/{evento}', None),
+    ('importar_compras', 'admin', 'POST', '/admin/importar-compras/{evento}',
+     {'archivo': b'comprador,descripcion,monto\nana,Vela,2.00\nluis,Taza,4.50\n'}),
+]
+
+
+def _form(data, seed):
+    if data is None:
+        return None
+    form = {}
+    for key, value in data.items():
+        if isinstance(value, bytes):
+            form[key] = (io.BytesIO(value), 'compras.csv')
+        else:
+            form[key] = value.format(**seed)
+    return form
+
+
+def _endpoint(app, method, path):
+    endpoint, _ = app.url_map.bind('localhost').match(path.split('?')[0], method=method)
+    return endpoint
+
+
+def test_every_route_has_a_budget_and_a_case(app_module, seed):
+    app = app_module.app
+    covered = {_endpoint(app, method, path.format(**seed)) for _, _, method, path, _ in CASES}
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        assert hasattr(app.view_functions[rule.endpoint], 'query_budget'), f'{rule.endpoint} no declara query_budget'
+        assert rule.endpoint in covered, f'{rule.endpoint} no tiene caso en CASES'
+
+
+@pytest.mark.parametrize('case', CASES, ids=[c[0] for c in CASES])
+def test_route_within_query_budget(case, app_module, seed, login):
+    _, username, method, path, data = case
+    app = app_module.app
+    client = login(username)
+    path = path.format(**seed)
+    endpoint = _endpoint(app, method, path)
+    budget = app.view_functions[endpoint].query_budget
+
+    before = metrics.REQUEST_QUERIES.snapshot(endpoint)
+    response = client.open(path, method=method, data=_form(data, seed))
+    response.get_data()
+    after = metrics.REQUEST_QUERIES.snapshot(endpoint)
+
+    assert response.status_code in (200, 302), response.status_code
+    assert after[1] == before[1] + 1
+    queries = after[0] - before[0]
+    assert queries <= budget, f'{endpoint}: {queries} consultas, presupuesto {budget}'
@@ -0,0 +1,94 @@
+# Lecturas en la réplica, escrituras y "leer lo que uno escribe" en el primario,
+# y vuelta al primario si la réplica se retrasa o no responde
+import time
+
+import psycopg2
+import pytest
+
+import models
+
+
+@pytest.fixture
+def replica(app_module, replica_url, monkeypatch):
+    monkeypatch.setenv('DATABASE_REPLICA_URL', replica_url)
+    monkeypatch.setitem(models._replica_state, 'ok', True)
+    monkeypatch.setitem(models._replica_state, 'checked', 0.0)
+    return replica_url
+
+
+def _checkouts(replica=False):
+    return models.get_pool(replica=replica).stats()['checkouts']
+
+
+def _wait_replicated(replica_url, sql, params, expected):
+    conn = psycopg2.connect(replica_url)
+    try:
+        for _ in range(100):
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            if cur.fetchone()[0] == expected:
+                return
+            conn.rollback()
+            time.sleep(0.05)
+        pytest.fail('la réplica no alcanzó al primario')
+    finally:
+        conn.close()
+
+
+def test_replica_is_a_hot_standby(replica):
+    conn = psycopg2.connect(replica)
+    cur = conn.cursor()
+    cur.execute('SELECT pg_is_in_recovery()')
+    assert cur.fetchone()[0]
+    assert 0 <= models._replica_lag(conn) < 60
+    conn.close()
+
+
+def test_reads_go_to_replica(replica, seed, login):
+    client = login('ana')
+    before, before_primary = _checkouts(replica=True), _checkouts()
+    response = client.get(f"/cuentas/{seed['evento']}")
+    assert response.status_code == 200
+    assert 'ana' in response.get_data(as_text=True)
+    assert _checkouts(replica=True) == before + 1
+    assert _checkouts() == before_primary
+    assert models.replica_stats()['ok'] == 1
+
+
+def test_session_reads_its_own_writes_on_primary(replica, seed, login):
+    luis, ana = login('luis'), login('ana')
+    luis.post('/compra', data={'evento_id': seed['evento'], 'descripcion': 'Farolillo', 'monto': '1.25'})
+
+    before = _checkouts(replica=True)
+    html = luis.get(f"/mis-compras/{seed['evento']}").get_data(as_text=True)
+    assert 'Farolillo' in html
+    assert _checkouts(replica=True) == before
+
+    # Otra sesión sigue leyendo de la réplica (y ve la compra una vez replicada)
+    _wait_replicated(replica, 'SELECT count(*) FROM compras WHERE descripcion = %s', ('Farolillo',), 1)
+    ana.get(f"/cuentas/{seed['evento']}")
+    assert _checkouts(replica=True) == before + 1
+
+
+def test_lagging_replica_falls_back_to_primary(replica, seed, login, monkeypatch):
+    monkeypatch.setattr(models, 'DB_REPLICA_MAX_LAG', -1)
+    client = login('ana')
+    before, before_primary = _checkouts(replica=True), _checkouts()
+    assert client.get(f"/cuentas/{seed['evento']}").status_code == 200
+    assert _checkouts() == before_primary + 1
+    assert models.replica_stats()['ok'] == 0
+    # Hasta la siguiente comprobación no se vuelve a intentar la réplica
+    assert client.get(f"/cuentas/{seed['evento']}").status_code == 200
+    assert _checkouts(replica=True) == before + 1
+
+
+def test_unreachable_replica_falls_back_to_primary(app_module, seed, login, monkeypatch):
+    monkeypatch.setenv('DATABASE_REPLICA_URL', 'postgresql://postgres@/postgres?host=/nonexistent')
+    monkeypatch.setitem(models._replica_state, 'checked', 0.0)
+    client = login('ana')
+    before_primary = _checkouts()
+    response = client.get(f"/cuentas/{seed['evento']}")
+    assert response.status_code == 200
+    assert 'ana' in response.get_data(as_text=True)
+    assert _checkouts() == before_primary + 1
+    assert models.replica_stats()['ok'] == 0
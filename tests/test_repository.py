@@ -0,0 +1,91 @@
+# El mismo contrato en los dos backends del repositorio; en Postgres, además,
+# las sentencias se preparan una sola vez por conexión
+import pytest
+
+from repository import PostgresRepository, Usuario
+
+
+def _aportado(repo, evento_id, username):
+    filas = repo.aportaciones_evento(evento_id, 'eva')
+    return {f.username: round(float(f.total_aportado), 2) for f in filas}.get(username)
+
+
+def test_rows_are_slotted(repo):
+    usuario = repo.usuario(repo.ids['ana'])
+    assert isinstance(usuario, Usuario)
+    assert (usuario.id, usuario.username) == (repo.ids['ana'], 'ana')
+    assert not hasattr(usuario, '__dict__')
+    assert repo.usuario(10 ** 6) is None
+    assert repo.credenciales('ana').password_hash
+
+
+def test_duplicate_username_raises_integrity_error(repo):
+    with pytest.raises(repo.IntegrityError):
+        repo.crear_usuario('ana', 'x')
+
+
+def test_event_includes_its_user(repo):
+    evento = repo.evento(repo.ids['evento'])
+    assert (evento.nombre, evento.usuario_evento) == ('Navidad', 'eva')
+
+
+def test_purchases_keep_balances_in_step(repo):
+    evento_id, luis = repo.ids['evento'], repo.ids['luis']
+    antes = _aportado(repo, evento_id, 'luis')
+    compra = repo.agregar_compra(evento_id, luis, 'luis', 'Vela', 2.5)
+    assert compra.descripcion == 'Vela'
+    assert _aportado(repo, evento_id, 'luis') == antes + 2.5
+    # Solo el comprador puede borrar su compra
+    assert repo.borrar_compra(compra.id, repo.ids['ana']) is None
+    borrada = repo.borrar_compra(compra.id, luis)
+    assert (borrada.id, borrada.evento_id) == (compra.id, evento_id)
+    assert _aportado(repo, evento_id, 'luis') == antes
+
+
+def test_purchase_pages_by_id(repo):
+    evento_id, ana = repo.ids['evento'], repo.ids['ana']
+    todas = repo.compras_usuario(evento_id, ana)
+    assert [c.id for c in todas] == sorted((c.id for c in todas), reverse=True)
+    vistas, antes = [], None
+    while True:
+        compras, antes = repo.compras_usuario(evento_id, ana, antes, limite=2)
+        vistas += [c.id for c in compras]
+        if antes is None:
+            break
+    assert vistas == [c.id for c in todas]
+
+
+def test_event_totals(repo):
+    totales = {t.username: round(float(t.total), 2) for t in repo.totales_evento(repo.ids['evento'])}
+    assert totales['ana'] >= 62.49
+    assert 'eva' not in totales
+
+
+def test_event_totals_are_ordered_by_latest_purchase(repo):
+    ana, luis = repo.ids['ana'], repo.ids['luis']
+    evento = repo.crear_evento('Orden de compradores', repo.ids['eva'])
+
+    def totales():
+        return [(t.username, round(float(t.total), 2)) for t in repo.totales_evento(evento)]
+
+    repo.agregar_compra(evento, ana, 'ana', 'Vela', '1.00')
+    repo.agregar_compra(evento, luis, 'luis', 'Taza', '2.00')
+    pila = repo.agregar_compra(evento, ana, 'ana', 'Pila', '3.00')
+    assert totales() == [('ana', 4.0), ('luis', 2.0)]
+    # Al borrar su última compra, ana vuelve a quedar por detrás
+    repo.borrar_compra(pila.id, ana)
+    assert totales() == [('luis', 2.0), ('ana', 1.0)]
+
+
+def test_statements_are_prepared_once_per_connection(repo):
+    if not isinstance(repo, PostgresRepository):
+        pytest.skip('solo Postgres')
+    repo.usuario(repo.ids['ana'])
+    repo.usuario(repo.ids['luis'])
+    cur = repo.conn.cursor()
+    cur.execute("SELECT count(*) FROM pg_prepared_statements WHERE name = 'repo_usuario'")
+    assert cur.fetchone()[0] == 1
+    assert 'usuario' in repo.conn.prepared
+    # Sin sentencias preparadas (pgbouncer en modo transacción) el resultado es el mismo
+    sin_preparar = PostgresRepository(repo.conn, prepare=False)
+    assert sin_preparar.evento(repo.ids['evento']).nombre == 'Navidad'
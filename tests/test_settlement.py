@@ -0,0 +1,43 @@
+import random
+
+from settlement import settle
+
+
+def _apply(saldos, transferencias):
+    restante = {u: round(s * 100) for u, s in saldos.items()}
+    for t in transferencias:
+        restante[t['de']] += round(t['importe'] * 100)
+        restante[t['para']] -= round(t['importe'] * 100)
+    return restante
+
+
+def test_simple_case():
+    transferencias = settle({'ana': 20.0, 'luis': -10.0, 'eva': -10.0})
+    assert sorted((t['de'], t['para'], t['importe']) for t in transferencias) == [
+        ('eva', 'ana', 10.0), ('luis', 'ana', 10.0)]
+
+
+def test_everyone_squared_needs_no_transfers():
+    assert settle({'ana': 0.0, 'luis': 0.004}) == []
+
+
+def test_random_balances_are_settled_with_at_most_n_minus_1_transfers():
+    rng = random.Random(7)
+    for n in (2, 5, 50, 500):
+        cents = [rng.randint(-50000, 50000) for _ in range(n - 1)]
+        cents.append(-sum(cents))
+        saldos = {f'u{i}': c / 100 for i, c in enumerate(cents)}
+        transferencias = settle(saldos)
+        assert len(transferencias) <= n - 1
+        assert all(t['importe'] > 0 for t in transferencias)
+        assert all(v == 0 for v in _apply(saldos, transferencias).values())
+
+
+def test_event_page_and_json_show_transfers(login, seed):
+    client = login('ana')
+    html = client.get(f"/cuentas/{seed['evento']}").get_data(as_text=True)
+    assert 'Transferencias para cuadrar' in html
+    data = client.get(f"/cuentas/{seed['evento']}/transferencias").get_json()
+    assert data['evento'] == 'Navidad'
+    restante = _apply({u: d['saldo'] for u, d in data['saldos'].items()}, data['transferencias'])
+    assert all(abs(v) <= len(restante) for v in restante.values())
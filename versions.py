@@ -0,0 +1,88 @@
+# Versiones de los datos para GET condicionales (ETag / Last-Modified -> 304).
+# - eventos.version: cambia con las compras de ese evento.
+# - versiones 'catalogo': altas y bajas de usuarios y eventos.
+# - versiones 'compras': cualquier compra de cualquier evento (cuenta total).
+# Las rutas de escritura llaman a bump() en la misma transacción que el cambio.
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from flask import Response, make_response, request, session
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+from cache import page_cache
+
+# Cambia en cada despliegue para que las plantillas nuevas no se sirvan como 304
+RELEASE = os.environ.get('RENDER_GIT_COMMIT', '')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def lookup(cur, evento_id=None):
+    # Una sola consulta: {'catalogo': (versión, modificado), 'compras': ..., 'evento': ...}
+    cur.execute('''
+        SELECT nombre, version, modificado FROM versiones
+        UNION ALL
+        SELECT 'evento', version, modificado FROM eventos WHERE id = %s
+    ''', (evento_id,))
+    return {nombre: (version, modificado) for nombre, version, modificado in cur.fetchall()}
+
+
+def bump(cur, *scopes, evento_id=None, comprador_id=None):
+    # scopes: 'catalogo' y/o 'compras'. evento_id: evento cuyas compras cambian.
+    # comprador_id: todos los eventos en los que ese usuario tiene compras.
+    cur.execute('''
+        WITH ev AS (
+            UPDATE eventos SET version = version + 1, modificado = now()
+            WHERE id = %(evento_id)s
+               OR id IN (SELECT evento_id FROM saldos WHERE usuario_id = %(comprador_id)s)
+        )
+        UPDATE versiones SET version = version + 1, modificado = now()
+        WHERE nombre = ANY(%(scopes)s)
+    ''', {'evento_id': evento_id, 'comprador_id': comprador_id, 'scopes': list(scopes)})
+    # Las páginas cacheadas de las versiones anteriores ya no se pueden servir: liberarlas.
+    # Todas las páginas dependen del catálogo (nombres de usuarios y eventos).
+    if 'catalogo' in scopes or comprador_id is not None:
+        page_cache.clear()
+    else:
+        prefixes = [f'{scope}.' for scope in scopes]
+        if evento_id is not None:
+            prefixes.append(f'evento-{evento_id}.')
+        page_cache.invalidate(*prefixes)
+
+
+def validators(versiones, *scopes):
+    # Devuelve (etag, last_modified) para la petición actual, o (None, None) si no
+    # debe cachearse: mensajes flash pendientes o un ámbito inexistente (evento borrado)
+    if session.get('_flashes') or any(s not in versiones for s in scopes):
+        return None, None
+    parts = [RELEASE, str(current_user.get_id()), request.full_path]
+    last_modified = _EPOCH
+    for scope in scopes:
+        version, modificado = versiones[scope]
+        parts.append(f'{scope}={version}')
+        last_modified = max(last_modified, modificado)
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest(), last_modified
+
+
+def _set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Contenido por usuario: solo en la caché del navegador y siempre revalidando
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified):
+    if etag is None or is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return _set_validators(Response(status=304), etag, last_modified)
+
+
+def with_validators(body, etag, last_modified):
+    response = make_response(body)
+    if etag is not None:
+        _set_validators(response, etag, last_modified)
+    return response